@@ -0,0 +1,132 @@
+import asyncio
+from typing import Dict, List, Optional
+
+from pyrogram import Client
+from pytgcalls import PyTgCalls
+
+from config import API_ID, API_HASH, ASSISTANT_SESSIONS
+
+
+class Assistant:
+    """One userbot account and the PyTgCalls instance that streams through it."""
+
+    def __init__(self, index: int, session_string: str):
+        self.index = index
+        self.client = Client(f"userbot_py_{index}" if index else "userbot_py", api_id=API_ID, api_hash=API_HASH,
+                             session_string=session_string)
+        self.calls = PyTgCalls(self.client)
+        self.chats = set()
+
+    @property
+    def load(self) -> int:
+        return len(self.chats)
+
+    def __repr__(self) -> str:
+        return f"Assistant({self.index}, chats={self.load})"
+
+
+class AssistantPool:
+    """Voice calls spread over several userbot accounts.
+
+    Exposes the PyTgCalls methods the bot uses, taking the chat_id of each
+    call to the assistant the chat was given: the least loaded one when it
+    first plays, kept until the bot leaves the call. Updates (stream ends)
+    from an assistant are only handed on for the chats it holds.
+    """
+
+    def __init__(self, sessions: List[str] = ASSISTANT_SESSIONS):
+        if not sessions:
+            raise ValueError("ASSISTANT_SESSIONS needs at least one session string")
+        self.assistants = [Assistant(index, session) for index, session in enumerate(sessions)]
+        self.assigned: Dict[int, Assistant] = {}
+
+    def find(self, chat_id: int) -> Optional[Assistant]:
+        return self.assigned.get(chat_id)
+
+    def assign(self, chat_id: int) -> Assistant:
+        """The chat's assistant, giving it the least loaded one if it has none."""
+        assistant = self.assigned.get(chat_id)
+        if assistant is None:
+            assistant = min(self.assistants, key=lambda a: a.load)
+            assistant.chats.add(chat_id)
+            self.assigned[chat_id] = assistant
+        return assistant
+
+    def _calls_for(self, chat_id: int) -> PyTgCalls:
+        assistant = self.assigned.get(chat_id) or self.assistants[0]
+        return assistant.calls
+
+    def unassign(self, chat_id: int):
+        assistant = self.assigned.pop(chat_id, None)
+        if assistant:
+            assistant.chats.discard(chat_id)
+
+    async def start(self):
+        await asyncio.gather(*(assistant.calls.start() for assistant in self.assistants))
+
+    async def stop(self):
+        results = await asyncio.gather(
+            *(assistant.client.stop() for assistant in self.assistants if assistant.client.is_connected),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"Error stopping assistant: {str(result)}")
+
+    def on_update(self, filters=None):
+        def decorator(func):
+            for assistant in self.assistants:
+                assistant.calls.on_update(filters)(self._routed(assistant, func))
+            return func
+        return decorator
+
+    def _routed(self, assistant: Assistant, func):
+        async def handler(client, update):
+            owner = self.assigned.get(getattr(update, "chat_id", None))
+            if owner is not None and owner is not assistant:
+                return
+            await func(client, update)
+        return handler
+
+    async def play(self, chat_id: int, stream=None, config=None):
+        joining = chat_id not in self.assigned
+        assistant = self.assign(chat_id)
+        try:
+            await assistant.calls.play(chat_id, stream, config)
+        except Exception:
+            if joining:
+                self.unassign(chat_id)
+            raise
+
+    async def leave_call(self, chat_id: int):
+        try:
+            await self._calls_for(chat_id).leave_call(chat_id)
+        finally:
+            self.unassign(chat_id)
+
+    async def pause(self, chat_id: int) -> bool:
+        return await self._calls_for(chat_id).pause(chat_id)
+
+    async def resume(self, chat_id: int) -> bool:
+        return await self._calls_for(chat_id).resume(chat_id)
+
+    async def time(self, chat_id: int) -> int:
+        return await self._calls_for(chat_id).time(chat_id)
+
+    async def change_volume_call(self, chat_id: int, volume: int):
+        await self._calls_for(chat_id).change_volume_call(chat_id, volume)
+
+    @property
+    async def calls(self):
+        merged = {}
+        for assistant in self.assistants:
+            merged.update(await assistant.calls.calls)
+        return merged
+
+    @property
+    def ping(self) -> float:
+        return sum(assistant.calls.ping for assistant in self.assistants) / len(self.assistants)
+
+    def stats(self) -> List[int]:
+        """Chats held by each assistant."""
+        return [assistant.load for assistant in self.assistants]
@@ -0,0 +1,688 @@
+"""Benchmarks for the bot's hot paths.
+
+Run against a local stub of the JioSaavn API, no Telegram access needed:
+
+    python bench.py http --concurrency 1 8 32 128
+    python bench.py library --entries 50000
+    python bench.py memory --parallel 8 --track-kb 10240
+    python bench.py search --parallel 50
+    python bench.py sessions --chats 500 --tracks 5
+    python bench.py startup --entries 20000 --login 1.0
+    python bench.py ttfa --track-kb 8192 --bandwidth-kb 2048
+    python bench.py tracks --tracks 50000
+    python bench.py transcode --streams 8 --seconds 180
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import random
+import resource
+import tracemalloc
+from dataclasses import dataclass
+import urllib.parse
+import urllib.request
+from time import perf_counter, process_time
+
+from aiohttp import web
+
+from saavn import SaavnClient, best_download
+from library import LibraryIndex, normalize
+from track_cache import TrackCache
+from tracks import Track
+from transcode import SAMPLE_RATE, CHANNELS
+
+
+async def _serve_stub(latency: float, track_size: int, bandwidth: int = 0):
+    payload = os.urandom(track_size)
+
+    async def search(request: web.Request):
+        await asyncio.sleep(latency)
+        query = request.query.get("query", "")
+        song_id = str(abs(hash(query)) % 10 ** 8)
+        base = f"http://{request.host}"
+        result = {
+            "id": song_id,
+            "name": query,
+            "primaryArtists": "Stub Artist",
+            "album": {"name": "Stub Album"},
+            "duration": "180",
+            "image": [{"quality": "500x500", "link": f"{base}/image/{song_id}.jpg"}],
+            "downloadUrl": [
+                {"quality": "160kbps", "link": f"{base}/audio/{song_id}.mp3?q=160"},
+                {"quality": "320kbps", "link": f"{base}/audio/{song_id}.mp3?q=320"},
+            ],
+        }
+        return web.json_response({"status": "SUCCESS", "data": {"results": [result]}})
+
+    async def audio(request: web.Request):
+        await asyncio.sleep(latency)
+        if not bandwidth:
+            return web.Response(body=payload, content_type="audio/mpeg")
+        response = web.StreamResponse(headers={"Content-Type": "audio/mpeg", "Content-Length": str(track_size)})
+        await response.prepare(request)
+        chunk = 64 * 1024
+        for offset in range(0, track_size, chunk):
+            await response.write(payload[offset:offset + chunk])
+            await asyncio.sleep(chunk / bandwidth)
+        return response
+
+    app = web.Application()
+    app.router.add_get("/search/songs", search)
+    app.router.add_get("/audio/{name}", audio)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def _stub_process(latency: float, track_size: int, bandwidth: int, conn):
+    async def serve():
+        runner, url = await _serve_stub(latency, track_size, bandwidth)
+        conn.send(url)
+        await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+        await runner.cleanup()
+
+    asyncio.run(serve())
+
+
+def start_stub_server(latency: float = 0.05, track_size: int = 256 * 1024, bandwidth: int = 0):
+    """Serve /search/songs and /audio/<id>.mp3 on a random local port.
+
+    The server runs in its own process so a blocking client cannot starve
+    it and its buffers stay out of the memory numbers. A non-zero bandwidth
+    (bytes/s) throttles audio responses. Returns (base_url, stop).
+    """
+    ctx = multiprocessing.get_context("spawn")
+    parent, child = ctx.Pipe()
+    process = ctx.Process(target=_stub_process, args=(latency, track_size, bandwidth, child), daemon=True)
+    process.start()
+    url = parent.recv()
+
+    def stop():
+        parent.send(None)
+        process.join(5)
+
+    return url, stop
+
+
+async def play_async(client: SaavnClient, query: str, out_dir: str):
+    results = await client.search_songs(query)
+    song = results[0]
+    await client.download(song["downloadUrl"][-1]["link"], os.path.join(out_dir, f"{song['id']}.mp3"))
+
+
+async def play_blocking(base_url: str, query: str, out_dir: str):
+    """The pre-aiohttp /play: synchronous HTTP inside the coroutine."""
+    with urllib.request.urlopen(f"{base_url}/search/songs?query={urllib.parse.quote(query)}") as response:
+        song = json.load(response)["data"]["results"][0]
+    with urllib.request.urlopen(song["downloadUrl"][-1]["link"]) as response:
+        content = response.read()
+    with open(os.path.join(out_dir, f"{song['id']}.mp3"), "wb") as f:
+        f.write(content)
+
+
+async def bench_http(args):
+    base_url, stop_server = start_stub_server(args.latency, args.track_kb * 1024)
+    out_dir = tempfile.mkdtemp(prefix="bench_http_")
+    client = SaavnClient(base_url=base_url)
+    try:
+        print(f"{'mode':<10}{'concurrency':>12}{'seconds':>10}{'plays/s':>10}")
+        for concurrency in args.concurrency:
+            for mode in ("blocking", "async"):
+                queries = [f"song {mode} {concurrency} {i}" for i in range(concurrency)]
+                start = perf_counter()
+                if mode == "async":
+                    await asyncio.gather(*(play_async(client, q, out_dir) for q in queries))
+                else:
+                    await asyncio.gather(*(play_blocking(base_url, q, out_dir) for q in queries))
+                elapsed = perf_counter() - start
+                print(f"{mode:<10}{concurrency:>12}{elapsed:>10.3f}{concurrency / elapsed:>10.1f}")
+    finally:
+        await client.close()
+        stop_server()
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+async def download_buffered(client: SaavnClient, url: str, path: str):
+    """The pre-streaming download: whole body in memory, then one write."""
+    async with client.session().get(url, timeout=client.download_timeout) as response:
+        content = await response.read()
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+async def bench_memory(args):
+    base_url, stop_server = start_stub_server(0, args.track_kb * 1024)
+    out_dir = tempfile.mkdtemp(prefix="bench_memory_")
+    client = SaavnClient(base_url=base_url)
+    try:
+        print(f"{'mode':<10}{'parallel':>10}{'track MiB':>11}{'peak MiB':>10}{'peak/download KiB':>19}")
+        for mode in ("buffered", "streamed"):
+            # Warm the connection pool so its buffers are not counted.
+            await client.download(f"{base_url}/audio/warmup.mp3", os.path.join(out_dir, "warmup.mp3"))
+            tracemalloc.start()
+            jobs = []
+            for i in range(args.parallel):
+                url = f"{base_url}/audio/{mode}{i}.mp3"
+                path = os.path.join(out_dir, f"{mode}{i}.mp3")
+                if mode == "buffered":
+                    jobs.append(download_buffered(client, url, path))
+                else:
+                    jobs.append(client.download(url, path))
+            await asyncio.gather(*jobs)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{mode:<10}{args.parallel:>10}{args.track_kb / 1024:>11.1f}{peak / 2 ** 20:>10.2f}"
+                  f"{peak / args.parallel / 1024:>19.0f}")
+    finally:
+        await client.close()
+        stop_server()
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+async def bench_search(args):
+    base_url, stop_server = start_stub_server(args.latency)
+    client = SaavnClient(base_url=base_url)
+    upstream = 0
+    get_json = client.get_json
+
+    async def counting_get_json(path):
+        nonlocal upstream
+        upstream += 1
+        return await get_json(path)
+
+    client.get_json = counting_get_json
+    try:
+        start = perf_counter()
+        await asyncio.gather(*(client.search_songs("Kesariya  Arijit") for _ in range(args.parallel)))
+        cold = perf_counter() - start
+        print(f"cold: {args.parallel} identical concurrent searches in {cold * 1000:.1f} ms, "
+              f"{upstream} upstream request(s)")
+        start = perf_counter()
+        for _ in range(args.repeat):
+            await client.search_songs("kesariya arijit")
+        warm = (perf_counter() - start) / args.repeat
+        print(f"warm: {warm * 1e6:.2f} us per repeated search, {upstream} upstream request(s) total")
+    finally:
+        await client.close()
+        stop_server()
+
+
+class FakeCalls:
+    """Stands in for PyTgCalls, records what each chat was sent."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.active = {}
+        self.played = {}
+
+    @property
+    async def calls(self):
+        return self.active
+
+    async def play(self, chat_id, stream=None):
+        await asyncio.sleep(self.latency)
+        self.active[chat_id] = True
+        if stream is not None:
+            self.played.setdefault(chat_id, []).append(stream)
+
+    async def leave_call(self, chat_id):
+        self.active.pop(chat_id, None)
+
+
+class FakeBot:
+    async def send_message(self, chat_id, text, **kwargs):
+        pass
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        pass
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        pass
+
+
+class FakeMessage:
+    def __init__(self, chat_id: int, text: str):
+        self.chat = type("Chat", (), {"id": chat_id})()
+        self.id = 1
+        self.command = text.split()
+        self.reply_to_message = None
+
+    async def reply(self, text, **kwargs):
+        pass
+
+    async def reply_photo(self, photo, **kwargs):
+        pass
+
+
+async def bench_sessions(args):
+    os.chdir(tempfile.mkdtemp(prefix="bench_sessions_"))
+    import unmain
+    from pytgcalls.types import Device, StreamEnded
+
+    unmain.AudioPiped = lambda path, **kwargs: path
+    bot = unmain.MusicBot()
+    bot.pytgcalls = FakeCalls(args.latency)
+    bot.bot = bot.outbox.client = FakeBot()
+
+    async def fake_fetch_song(query):
+        await asyncio.sleep(args.latency)
+        return unmain.Track(path=query, title=query)
+
+    bot.fetch_song = fake_fetch_song
+    chats = [-100_000_000 - i for i in range(args.chats)]
+
+    async def chat_plays(chat_id):
+        for n in range(args.tracks):
+            await bot.play_song(None, FakeMessage(chat_id, f"/play {chat_id}:{n}"))
+
+    start = perf_counter()
+    await asyncio.gather(*(chat_plays(chat_id) for chat_id in chats))
+    queued = perf_counter() - start
+
+    async def chat_stream_ends(chat_id):
+        for _ in range(args.tracks - 1):
+            await bot.on_stream_end(None, StreamEnded(chat_id, StreamEnded.Type.AUDIO, Device.MICROPHONE))
+
+    start = perf_counter()
+    await asyncio.gather(*(chat_stream_ends(chat_id) for chat_id in chats))
+    advanced = perf_counter() - start
+
+    misrouted = sum(
+        bot.pytgcalls.played.get(chat_id) != [f"{chat_id}:{n}" for n in range(args.tracks)]
+        for chat_id in chats
+    )
+    plays = args.chats * args.tracks
+    print(f"{args.chats} chats x {args.tracks} tracks, {len(bot.sessions)} sessions")
+    print(f"/play:       {queued:.3f} s, {plays / queued:.0f} commands/s")
+    print(f"stream end:  {advanced:.3f} s, {args.chats * (args.tracks - 1) / advanced:.0f} track changes/s")
+    print(f"chats with wrong or out-of-order playback: {misrouted}")
+    gaps = [gap for session in bot.sessions for gap in session.gaps]
+    if gaps:
+        print(f"gap between tracks: {sum(gaps) / len(gaps):.1f} ms average, {max(gaps):.1f} ms worst")
+
+
+async def bench_startup(args):
+    """Boot time: clients started one after another with the cache read
+    inline, as the bot used to, against MusicBot.start.
+
+    Logins are simulated as args.login seconds each, the track cache is a
+    real one of args.entries (empty) files.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    imports = []
+    for _ in range(args.repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", "from time import perf_counter; s = perf_counter(); import unmain; print(perf_counter() - s)"],
+            cwd=tempfile.mkdtemp(prefix="bench_startup_"), env={**os.environ, "PYTHONPATH": here},
+            capture_output=True, text=True, check=True,
+        )
+        imports.append(float(result.stdout.split()[-1]))
+    print(f"import unmain: {statistics.median(imports):.2f} s (median of {args.repeat})")
+
+    os.chdir(tempfile.mkdtemp(prefix="bench_startup_"))
+    import unmain
+    from config import ASSISTANT_SESSIONS, TRACK_CACHE_DIR
+
+    rng = random.Random(0)
+    words = _vocabulary(rng, 5000)
+    weights = [1 / rank for rank in range(1, len(words) + 1)]
+    os.makedirs(TRACK_CACHE_DIR)
+    entries = []
+    for i in range(args.entries):
+        key = f"{i:08X}_320kbps"
+        open(os.path.join(TRACK_CACHE_DIR, f"{key}.mp3"), "wb").close()
+        entries.append({"key": key, "song_id": f"{i:08X}", "quality": "320kbps", "title": _title(rng, words, weights),
+                        "artist": _title(rng, words, weights), "album": _title(rng, words, weights)})
+    with open(os.path.join(TRACK_CACHE_DIR, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(entries, f)
+
+    async def login():
+        await asyncio.sleep(args.login)
+
+    def make_bot():
+        bot = unmain.MusicBot()
+        bot.pytgcalls = unmain.AssistantPool(ASSISTANT_SESSIONS * args.assistants)
+        bot.bot.start = login
+        for assistant in bot.pytgcalls.assistants:
+            assistant.calls.start = login
+        return bot
+
+    lag = [0.0]
+
+    async def watch_lag():
+        while True:
+            start = perf_counter()
+            await asyncio.sleep(0.01)
+            lag[0] = max(lag[0], perf_counter() - start - 0.01)
+
+    unmain.METRICS_PORT = 0
+    print(f"{args.assistants} assistants, {args.login:.1f} s per login, {args.entries} cached tracks")
+    print(f"{'mode':<12}{'commands s':>12}{'cache s':>10}{'max lag ms':>12}")
+
+    bot = make_bot()
+    watcher = asyncio.create_task(watch_lag())
+    start = perf_counter()
+    await bot.bot.start()
+    for assistant in bot.pytgcalls.assistants:
+        await assistant.calls.start()
+    bot.cache.load()
+    unmain.LibraryIndex(bot.cache)
+    ready = perf_counter() - start
+    # Let the watcher see the blocking load.
+    await asyncio.sleep(0.05)
+    print(f"{'sequential':<12}{ready:>12.2f}{ready:>10.2f}{lag[0] * 1000:>12.0f}")
+
+    bot = make_bot()
+    lag[0] = 0.0
+    start = perf_counter()
+    await bot.start()
+    ready = perf_counter() - start
+    await bot.cache_warm
+    warm = perf_counter() - start
+    # Let the resume behind it run, and the watcher see the last of it.
+    await asyncio.sleep(0.05)
+    print(f"{'concurrent':<12}{ready:>12.2f}{warm:>10.2f}{lag[0] * 1000:>12.0f}")
+    watcher.cancel()
+    for task in bot.background_tasks:
+        task.cancel()
+    bot.store.close()
+
+
+async def bench_ttfa(args):
+    """Time to first audio: full download first vs streaming the URL.
+
+    The first 4 KiB read stands in for ffmpeg opening the input.
+    """
+    base_url, stop_server = start_stub_server(args.latency, args.track_kb * 1024, args.bandwidth_kb * 1024)
+    out_dir = tempfile.mkdtemp(prefix="bench_ttfa_")
+    client = SaavnClient(base_url=base_url)
+    try:
+        print(f"{'mode':<10}{'first audio ms':>16}")
+        for i in range(args.repeat):
+            url = f"{base_url}/audio/{i}.mp3"
+            start = perf_counter()
+            path = await client.download(url, os.path.join(out_dir, f"{i}.mp3"))
+            with open(path, "rb") as f:
+                f.read(4096)
+            print(f"{'download':<10}{(perf_counter() - start) * 1000:>16.0f}")
+
+            start = perf_counter()
+            # The cache fills in parallel with the stream, as in the bot.
+            fill = asyncio.create_task(client.download(url, os.path.join(out_dir, f"{i}.direct.mp3")))
+            async with client.session().get(url, timeout=client.download_timeout) as response:
+                await response.content.read(4096)
+                first_audio = perf_counter() - start
+                async for _ in response.content.iter_chunked(64 * 1024):
+                    pass
+            await fill
+            print(f"{'direct':<10}{first_audio * 1000:>16.0f}")
+    finally:
+        await client.close()
+        stop_server()
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+@dataclass
+class LegacyTrack:
+    """Track as unmain.py defined it before it was slotted."""
+    path: str = ""
+    title: str = ""
+    thumbnail: str = ""
+    artist: str = ""
+    album: str = ""
+    duration: str = ""
+    song_id: str = ""
+    quality: str = ""
+    url: str = ""
+
+
+def legacy_track(song, download) -> LegacyTrack:
+    return LegacyTrack(
+        title=song.get("name", "Unknown Title"),
+        thumbnail=song.get("image", [])[-1].get("link") if song.get("image") else "",
+        artist=song.get("primaryArtists", "Unknown Artist"),
+        album=song.get("album", {}).get("name", "Unknown Album"),
+        duration=song.get("duration", "Unknown"),
+        song_id=song["id"], quality=download.get("quality", ""), url=download["link"],
+    )
+
+
+async def bench_tracks(args):
+    rng = random.Random(0)
+    songs = []
+    for i in range(args.songs):
+        artist, album = rng.randrange(args.songs // 8), rng.randrange(args.songs // 4)
+        songs.append(json.dumps({
+            "id": f"{i:08X}",
+            "name": f"Song number {i}",
+            "primaryArtists": f"Artist {artist}, Featured Artist {artist + 1}",
+            "album": {"name": f"Album {album} (Original Motion Picture Soundtrack)"},
+            "duration": str(120 + i % 240),
+            "image": [{"link": f"https://c.saavncdn.com/{album:03}/Album-{album}-Hindi-2023-500x500.jpg"}],
+            "downloadUrl": [{"quality": "320kbps", "link": f"https://aac.saavncdn.com/{album:03}/{i:08x}_320.mp4"}],
+        }))
+    # Every /play parses a fresh JSON response, so nothing is shared by accident.
+    picks = [rng.randrange(args.songs) for _ in range(args.tracks)]
+    cache_dir = tempfile.mkdtemp(prefix="bench_tracks_")
+    try:
+        print(f"{args.tracks} queued tracks drawn from {args.songs} songs")
+        for name, build in (("dataclass", legacy_track), ("slotted", Track.from_song)):
+            Track.metadata = TrackCache(None, directory=cache_dir)
+            tracemalloc.start()
+            tracks = []
+            for pick in picks:
+                song = json.loads(songs[pick])
+                tracks.append(build(song, best_download(song)))
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{name:<10}{current / 2 ** 20:>8.2f} MiB{current / args.tracks:>8.0f} B/track")
+            del tracks
+    finally:
+        Track.metadata = None
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+# Letters weighted by their frequency in English text.
+LETTERS = "etaoinshrdlcumwfgypbvkjxqz"
+LETTER_WEIGHTS = [12.7, 9.1, 8.2, 7.5, 7.0, 6.7, 6.3, 6.1, 6.0, 4.3, 4.0, 2.8, 2.8, 2.4, 2.4, 2.2, 2.0, 2.0, 1.9,
+                  1.5, 1.0, 0.8, 0.2, 0.2, 0.1, 0.1]
+
+
+def _vocabulary(rng, size: int):
+    return ["".join(rng.choices(LETTERS, LETTER_WEIGHTS, k=rng.randint(2, 9))) for _ in range(size)]
+
+
+def _title(rng, words, weights) -> str:
+    return " ".join(rng.choices(words, weights, k=rng.randint(2, 5))).title()
+
+
+def _typo(rng, text: str) -> str:
+    i = rng.randrange(len(text) - 1)
+    return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+
+
+async def bench_library(args):
+    rng = random.Random(0)
+    # Word frequencies follow Zipf's law, as in real titles.
+    words = _vocabulary(rng, args.words)
+    weights = [1 / rank for rank in range(1, len(words) + 1)]
+    artists = [_title(rng, words, weights) for _ in range(args.entries // 20 + 1)]
+    entries = []
+    for i in range(args.entries):
+        entries.append({
+            "key": f"{i:08X}_320kbps", "song_id": f"{i:08X}", "quality": "320kbps",
+            "title": _title(rng, words, weights), "artist": rng.choice(artists), "album": _title(rng, words, weights),
+        })
+    tracemalloc.start()
+    start = perf_counter()
+    index = LibraryIndex()
+    index.build(entries)
+    built = perf_counter() - start
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{args.entries} entries indexed in {built * 1000:.0f}ms, "
+          f"{len(index.postings)} words, {memory / 2 ** 20:.1f} MiB")
+
+    picks = [rng.choice(entries) for _ in range(args.queries)]
+    queries = {
+        "exact": [entry["title"] for entry in picks],
+        "typo": [_typo(rng, entry["title"]) for entry in picks],
+        "title+artist": [f"{entry['title']} {entry['artist']}" for entry in picks],
+        "miss": [_title(rng, words, weights) for _ in picks],
+    }
+    texts = [normalize(LibraryIndex.text(entry)) for entry in entries]
+    print(f"{'query':<14}{'p50 ms':>8}{'p95 ms':>8}{'max ms':>8}{'matched':>9}{'scan ms':>9}")
+    for kind, batch in queries.items():
+        timings, matched = [], 0
+        for query, entry in zip(batch, picks):
+            start = perf_counter()
+            index.search(query, args.limit)
+            found = index.match(query)
+            timings.append(perf_counter() - start)
+            # Titles repeat, any entry with the same one is right.
+            matched += found is not None and found["title"] == entry["title"]
+        timings.sort()
+        # What a plain substring scan of every entry costs, for reference.
+        start = perf_counter()
+        for query in batch[:20]:
+            needle = normalize(query)
+            [text for text in texts if needle in text]
+        scan = (perf_counter() - start) / min(20, len(batch))
+        print(f"{kind:<14}{timings[len(timings) // 2] * 1000:>8.2f}{timings[int(len(timings) * 0.95)] * 1000:>8.2f}"
+              f"{timings[-1] * 1000:>8.2f}{matched * 100 / len(batch):>8.0f}%{scan * 1000:>9.2f}")
+
+
+def _children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _read_raw(path: str):
+    with open(path, "rb") as f:
+        while f.read(64 * 1024):
+            pass
+
+
+async def bench_transcode(args):
+    """CPU spent per stream: live MP3 decoding vs reading pre-transcoded PCM.
+
+    Each stream plays the whole track as fast as possible, so the CPU time
+    is what a call would spread over the track's duration.
+    """
+    ffmpeg = shutil.which(args.ffmpeg)
+    if not ffmpeg:
+        print(f"{args.ffmpeg} not found, it is needed to decode MP3s")
+        return
+    out_dir = tempfile.mkdtemp(prefix="bench_transcode_")
+    mp3_path = os.path.join(out_dir, "track.mp3")
+    raw_path = os.path.join(out_dir, "track.pcm")
+    try:
+        for command in (
+            [ffmpeg, "-nostdin", "-v", "error", "-f", "lavfi", "-i", f"sine=frequency=440:duration={args.seconds}",
+             "-ac", "2", "-b:a", "320k", mp3_path],
+            [ffmpeg, "-nostdin", "-v", "error", "-i", mp3_path,
+             "-f", "s16le", "-ac", str(CHANNELS), "-ar", str(SAMPLE_RATE), raw_path],
+        ):
+            process = await asyncio.create_subprocess_exec(*command)
+            await process.wait()
+
+        async def decode():
+            process = await asyncio.create_subprocess_exec(
+                ffmpeg, "-nostdin", "-v", "error", "-i", mp3_path,
+                "-f", "s16le", "-ac", str(CHANNELS), "-ar", str(SAMPLE_RATE), "-",
+                stdout=asyncio.subprocess.DEVNULL,
+            )
+            await process.wait()
+
+        start = _children_cpu()
+        await asyncio.gather(*(decode() for _ in range(args.streams)))
+        decoded = (_children_cpu() - start) / args.streams
+
+        start = process_time()
+        await asyncio.gather(*(asyncio.to_thread(_read_raw, raw_path) for _ in range(args.streams)))
+        raw = (process_time() - start) / args.streams
+
+        minutes = args.seconds / 60
+        print(f"{args.streams} streams of a {args.seconds}s track, raw copy {os.path.getsize(raw_path) / 2 ** 20:.1f} MiB")
+        print(f"{'source':<8}{'CPU ms/stream':>15}{'CPU ms/stream-min':>19}")
+        print(f"{'mp3':<8}{decoded * 1000:>15.1f}{decoded * 1000 / minutes:>19.1f}")
+        print(f"{'raw':<8}{raw * 1000:>15.1f}{raw * 1000 / minutes:>19.1f}")
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    http = sub.add_parser("http", help="concurrent /play search + download throughput")
+    http.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    http.add_argument("--latency", type=float, default=0.05, help="stub server latency per request (s)")
+    http.add_argument("--track-kb", type=int, default=256)
+    http.set_defaults(func=bench_http)
+
+    memory = sub.add_parser("memory", help="peak Python heap while downloading tracks in parallel")
+    memory.add_argument("--parallel", type=int, default=8)
+    memory.add_argument("--track-kb", type=int, default=10 * 1024)
+    memory.set_defaults(func=bench_memory)
+
+    search = sub.add_parser("search", help="memoized and single-flight search latency")
+    search.add_argument("--parallel", type=int, default=50)
+    search.add_argument("--repeat", type=int, default=10000)
+    search.add_argument("--latency", type=float, default=0.2)
+    search.set_defaults(func=bench_search)
+
+    sessions = sub.add_parser("sessions", help="load test many chats playing through one MusicBot")
+    sessions.add_argument("--chats", type=int, default=500)
+    sessions.add_argument("--tracks", type=int, default=5)
+    sessions.add_argument("--latency", type=float, default=0.01, help="simulated fetch and call latency (s)")
+    sessions.set_defaults(func=bench_sessions)
+
+    startup = sub.add_parser("startup", help="boot time, sequential vs concurrent client start")
+    startup.add_argument("--entries", type=int, default=20000, help="tracks in the cache index")
+    startup.add_argument("--login", type=float, default=1.0, help="simulated login time per client (s)")
+    startup.add_argument("--assistants", type=int, default=2)
+    startup.add_argument("--repeat", type=int, default=3, help="runs of the import timing")
+    startup.set_defaults(func=bench_startup)
+
+    ttfa = sub.add_parser("ttfa", help="time to first audio, download-then-play vs direct streaming")
+    ttfa.add_argument("--track-kb", type=int, default=8 * 1024)
+    ttfa.add_argument("--bandwidth-kb", type=int, default=2 * 1024, help="stub download speed (KiB/s)")
+    ttfa.add_argument("--latency", type=float, default=0.1)
+    ttfa.add_argument("--repeat", type=int, default=3)
+    ttfa.set_defaults(func=bench_ttfa)
+
+    library = sub.add_parser("library", help="fuzzy search latency over the downloaded library")
+    library.add_argument("--entries", type=int, default=50000)
+    library.add_argument("--queries", type=int, default=500)
+    library.add_argument("--words", type=int, default=20000, help="vocabulary the titles are drawn from")
+    library.add_argument("--limit", type=int, default=8, help="results per /search")
+    library.set_defaults(func=bench_library)
+
+    tracks = sub.add_parser("tracks", help="memory held by queued Track objects")
+    tracks.add_argument("--tracks", type=int, default=50000)
+    tracks.add_argument("--songs", type=int, default=5000)
+    tracks.set_defaults(func=bench_tracks)
+
+    transcode = sub.add_parser("transcode", help="CPU per stream, live MP3 decoding vs raw PCM")
+    transcode.add_argument("--streams", type=int, default=8)
+    transcode.add_argument("--seconds", type=int, default=180, help="length of the generated test track")
+    transcode.add_argument("--ffmpeg", default="ffmpeg")
+    transcode.set_defaults(func=bench_transcode)
+
+    args = parser.parse_args()
+    asyncio.run(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
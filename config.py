@@ -5,3 +5,46 @@ SESSION_NAME = "BAGClh0APfuQhECYt3eB_S-jBdjZ0DreZnhcmquFG5BtC2gcaSQGsTZ4SPcb83Ie
 STRING_SESSION = "" # Name for userbot session
 ADMIN_IDS = [123456789]  # Telegram user IDs of admins
 CHAT_ID = -100123456789  # Group/channel ID where the bot will operate
+SAAVN_API_URL = "https://jiosaavn-api-privatecvc2.vercel.app"  # JioSaavn API base URL
+HTTP_POOL_SIZE = 100  # Max open HTTP connections shared by all requests
+HTTP_PER_HOST_LIMIT = 10  # Max concurrent connections to a single host
+HTTP_TIMEOUT = 10  # Seconds allowed for an API request
+DOWNLOAD_READ_TIMEOUT = 30  # Seconds a download may stall before it is aborted
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # Bytes held in memory per download while streaming to disk
+TRACK_CACHE_DIR = "downloads"  # Where downloaded tracks and their index are kept
+TRACK_CACHE_MAX_MB = 2048  # Disk budget for cached tracks, least recently played are evicted first
+TRACK_CACHE_SAVE_DELAY = 5  # Seconds index changes are batched for before index.json is rewritten
+SEARCH_CACHE_TTL = 600  # Seconds a search result is reused for the same query
+SEARCH_CACHE_SIZE = 1024  # Max distinct queries kept in memory
+PREFETCH_DEPTH = 3  # Upcoming tracks per chat downloaded ahead of time
+PREFETCH_CONCURRENCY = 4  # Max background downloads across all chats
+DIRECT_STREAMING = True  # Stream tracks that are not cached yet straight from JioSaavn while they download
+QUEUE_PAGE_SIZE = 15  # Tracks per page of /queue
+TRACK_METADATA_SIZE = 20000  # Songs whose album/thumbnail are kept in memory
+THUMBNAIL_SIZE = 320  # Now-playing cover images are shrunk to fit this many pixels square
+SHELL_TIMEOUT = 300  # Seconds a /sh command may run before it is killed
+SHELL_EDIT_INTERVAL = 2  # Seconds between /sh live output updates
+STATE_DB_PATH = "state.db"  # SQLite file holding every chat's queue, restored on restart
+TRANSCODE_RAW = False  # Convert cached tracks once to raw 48 kHz PCM so calls skip live MP3 decoding (about 11 MB per minute of audio)
+TRANSCODE_WORKERS = 2  # Max ffmpeg conversions running at once
+FFMPEG_BINARY = "ffmpeg"  # ffmpeg executable used for conversions
+LOUDNESS_NORMALIZATION = True  # Measure each cached track's loudness once and play it at LOUDNESS_TARGET_LUFS
+LOUDNESS_TARGET_LUFS = -14.0  # Integrated loudness (EBU R128) tracks are brought to
+LOUDNESS_MAX_GAIN_DB = 12.0  # Largest boost or cut applied to a track
+LOUDNESS_WORKERS = 2  # Max ffmpeg loudness scans running at once
+TRANSITIONS = True  # Switch to the next cached track just before the current one ends instead of after the stream stops
+CROSSFADE_SECONDS = 3  # Overlap of the current track's end with the next one's start, 0 joins them back to back
+TRANSITION_MARGIN = 3  # Extra seconds before the crossfade point at which the switch is made
+METRICS_HOST = "127.0.0.1"  # Interface the Prometheus metrics endpoint listens on
+METRICS_PORT = 9464  # Port of http://METRICS_HOST:METRICS_PORT/metrics, 0 disables it
+OUTBOX_CHAT_RATE = 0.33  # Messages per second sent to one chat on average (Telegram allows about 20 a minute in groups)
+OUTBOX_CHAT_BURST = 3  # Messages a chat may get at once before OUTBOX_CHAT_RATE applies
+OUTBOX_GLOBAL_RATE = 25  # Messages per second across all chats
+OUTBOX_COALESCE_WINDOW = 60  # Seconds during which a status update edits the previous one instead of posting anew
+OUTBOX_MAX_RETRIES = 3  # Times a message is retried after a FloodWait before it is dropped
+PLAY_RETRIES = 2  # Extra attempts to start a failing track, each with another download quality when there is one
+PLAY_RETRY_DELAY = 1  # Seconds before the first retry, doubled for each one after
+PLAY_MAX_FAILURES = 3  # Tracks in a row that may fail to play before playback stops
+ASSISTANT_SESSIONS = [SESSION_NAME]  # Session strings of the userbot accounts voice chats are spread over, least loaded first
+LIBRARY_MATCH_SCORE = 0.8  # How closely a /play query must match a downloaded track to skip the JioSaavn search
+LIBRARY_SEARCH_RESULTS = 8  # Downloaded tracks listed by /search
@@ -0,0 +1,203 @@
+import heapq
+import math
+import re
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from config import LIBRARY_MATCH_SCORE
+
+# Dice similarity of their trigrams above which a query word matches an indexed one.
+WORD_SIMILARITY = 0.6
+
+
+def normalize(text: str) -> str:
+    return " ".join(re.sub(r"[\W_]+", " ", text.casefold()).split())
+
+
+def words(text: str) -> List[str]:
+    """The distinct normalized words of text, in order."""
+    return list(dict.fromkeys(normalize(text).split()))
+
+
+def trigrams(word: str) -> Set[str]:
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _union(postings: List[array]):
+    return postings[0] if len(postings) == 1 else set().union(*postings)
+
+
+def _contains(posting: array, doc: int) -> bool:
+    i = bisect_left(posting, doc)
+    return i < len(posting) and posting[i] == doc
+
+
+class LibraryIndex:
+    """Fuzzy search over the tracks in the TrackCache, with no network access.
+
+    Each cached entry is indexed by the words of its title, artist and
+    album: `postings` maps a word to the ids of the entries holding it.
+    Misspelt words are found through `vocabulary`, which maps trigrams to
+    the indexed words containing them, so a query word also matches the
+    words sharing most of its trigrams. An entry scores the share of the
+    query's words it holds.
+
+    Removed entries are left as holes in `docs` and skipped until enough
+    pile up to rebuild the index. It follows the cache through its
+    listener hooks, see `follow`.
+    """
+
+    SIMILAR_CACHE_SIZE = 4096
+
+    def __init__(self, cache=None):
+        self.postings: Dict[str, array] = {}
+        self.vocabulary: Dict[str, Set[str]] = {}
+        # Doc id -> cache entry, None once removed.
+        self.docs: List[Optional[Dict[str, Any]]] = []
+        self.sizes = array("H")
+        self.ids: Dict[str, int] = {}
+        self.holes: Set[int] = set()
+        self.hits = 0
+        self.searches = 0
+        self._similar: Dict[str, List[str]] = {}
+        if cache is not None:
+            self.follow(cache)
+
+    def build(self, entries):
+        self.postings, self.vocabulary, self._similar = {}, {}, {}
+        self.docs, self.sizes, self.ids, self.holes = [], array("H"), {}, set()
+        for entry in entries:
+            self.added(entry["key"], entry)
+
+    def follow(self, cache):
+        """Catch up with the cache's entries and keep up with it from now on.
+
+        Entries removed from the cache since the index was built are
+        dropped and the new ones added, so the index may be built from a
+        snapshot of the entries, off the event loop.
+        """
+        for key in [key for key in self.ids if key not in cache.entries]:
+            self.removed(key)
+        for key, entry in cache.entries.items():
+            if key not in self.ids:
+                self.added(key, entry)
+        cache.listener = self
+
+    @staticmethod
+    def text(entry: Dict[str, Any]) -> str:
+        return " ".join(entry.get(field) or "" for field in ("title", "artist", "album"))
+
+    def added(self, key: str, entry: Dict[str, Any]):
+        if key in self.ids:
+            self.removed(key)
+        found = words(self.text(entry))
+        if not entry.get("song_id") or not entry.get("title") or not found:
+            return
+        doc = len(self.docs)
+        self.docs.append(entry)
+        self.sizes.append(min(len(found), 0xFFFF))
+        self.ids[key] = doc
+        for word in found:
+            posting = self.postings.get(word)
+            if posting is None:
+                posting = self.postings[word] = array("I")
+                for gram in trigrams(word):
+                    self.vocabulary.setdefault(gram, set()).add(word)
+                # A new word may be the closest match of a cached query word.
+                self._similar.clear()
+            posting.append(doc)
+
+    def removed(self, key: str):
+        doc = self.ids.pop(key, None)
+        if doc is None:
+            return
+        self.docs[doc] = None
+        self.holes.add(doc)
+        if len(self.holes) > 1000 and len(self.holes) * 4 > len(self.docs):
+            self.build([entry for entry in self.docs if entry is not None])
+
+    def similar(self, word: str) -> List[str]:
+        """Indexed words matching word: itself, or those spelt nearly the same."""
+        if word in self.postings:
+            return [word]
+        found = self._similar.get(word)
+        if found is None:
+            grams = trigrams(word)
+            shared = Counter()
+            for gram in grams:
+                shared.update(self.vocabulary.get(gram, ()))
+            # An indexed word has len(other) + 1 trigrams, see trigrams.
+            found = [other for other, count in shared.items()
+                     if 2 * count >= WORD_SIMILARITY * (len(grams) + len(other) + 1)]
+            if len(self._similar) >= self.SIMILAR_CACHE_SIZE:
+                self._similar.clear()
+            self._similar[word] = found
+        return found
+
+    def search(self, query: str, limit: int = 10, least: float = 0.5) -> List[Tuple[float, Dict[str, Any]]]:
+        """Up to limit (score, entry) pairs matching query, best first.
+
+        The score is the share of the query's words in the entry, ties go
+        to the entry with fewer words (the closer match). Entries scoring
+        under least are left out, which keeps common words cheap: such an
+        entry must hold one of the query's rarer words, so only their
+        postings are counted and the common words are just looked up for
+        the entries found.
+        """
+        self.searches += 1
+        wanted = words(query)
+        if not wanted or not self.docs:
+            return []
+        matches = sorted(
+            ([self.postings[similar] for similar in self.similar(word)] for word in wanted),
+            key=lambda postings: sum(map(len, postings)),
+        )
+        needed = max(1, math.ceil(len(wanted) * least))
+        split = len(wanted) - needed + 1
+        counts = Counter()
+        for postings in matches[:split]:
+            if postings:
+                counts.update(_union(postings))
+        candidates = list(counts)
+        for postings in matches[split:]:
+            if len(candidates) * 8 > sum(map(len, postings)):
+                # Cheaper to count it all, entries that were not candidates
+                # still end up under needed.
+                counts.update(_union(postings))
+                continue
+            # Postings are in doc id order, see added.
+            for doc in candidates:
+                if any(_contains(posting, doc) for posting in postings):
+                    counts[doc] += 1
+        results = []
+        for score in range(len(wanted), needed - 1, -1):
+            if len(results) >= limit:
+                break
+            tier = [doc for doc, count in counts.items() if count == score and doc not in self.holes]
+            best = heapq.nsmallest(limit - len(results), tier, key=self.sizes.__getitem__)
+            results.extend((score / len(wanted), self.docs[doc]) for doc in best)
+        return results
+
+    def match(self, query: str, threshold: float = LIBRARY_MATCH_SCORE) -> Optional[Dict[str, Any]]:
+        """The entry query is surely asking for, or None.
+
+        The best result must hold the query's words (typos aside) and the
+        query must name most of its title, so "love" does not play the one
+        cached song with love in its name.
+        """
+        results = self.search(query, 1, threshold)
+        if not results:
+            return None
+        entry = results[0][1]
+        named = {similar for word in words(query) for similar in self.similar(word)}
+        title = words(entry["title"])
+        if sum(word in named for word in title) < threshold * len(title):
+            return None
+        self.hits += 1
+        return entry
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self.ids), "words": len(self.postings), "searches": self.searches, "hits": self.hits}
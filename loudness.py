@@ -0,0 +1,101 @@
+import asyncio
+import json
+import re
+from typing import Dict, Optional
+
+from config import (
+    LOUDNESS_TARGET_LUFS, LOUDNESS_MAX_GAIN_DB, LOUDNESS_WORKERS, FFMPEG_BINARY,
+)
+from track_cache import TrackCache
+
+# Highest true peak (dBTP) a boosted track may reach, so the gain never clips.
+PEAK_CEILING = -1.0
+
+
+def volume_filter(gain: Optional[float]) -> Optional[str]:
+    """MediaStream ffmpeg_parameters applying gain dB after the input is opened."""
+    if not gain:
+        return None
+    return f"-atmid -af volume={gain:.2f}dB"
+
+
+class LoudnessAnalyzer:
+    """Measures each cached track once and stores the gain that normalizes it.
+
+    ffmpeg's loudnorm filter reports the integrated loudness (EBU R128) and
+    true peak of the file. The gain to bring it to `target` LUFS, limited to
+    `max_gain` dB and to what the peak allows, is kept in the track's
+    cache index entry as `gain_db`, so playback just applies it as a
+    volume filter with no analysis of its own.
+    """
+
+    def __init__(self, cache: TrackCache, workers: int = LOUDNESS_WORKERS, target: float = LOUDNESS_TARGET_LUFS,
+                 max_gain: float = LOUDNESS_MAX_GAIN_DB, ffmpeg: str = FFMPEG_BINARY):
+        self.cache = cache
+        self.target = target
+        self.max_gain = max_gain
+        self.ffmpeg = ffmpeg
+        self.semaphore = asyncio.Semaphore(workers)
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.done = 0
+        self.failed = 0
+
+    def gain_for(self, path: str) -> Optional[float]:
+        entry = self.cache.entry_for(path)
+        return entry.get("gain_db") if entry else None
+
+    def schedule(self, path: str) -> Optional[asyncio.Task]:
+        """Start measuring the cached track at path unless it is done or underway."""
+        entry = self.cache.entry_for(path)
+        if entry is None or "gain_db" in entry:
+            return None
+        task = self.tasks.get(path)
+        if task is None:
+            task = asyncio.create_task(self._analyze(path))
+            self.tasks[path] = task
+            task.add_done_callback(lambda t: self.tasks.pop(path, None))
+        return task
+
+    async def analyze(self, path: str) -> Optional[float]:
+        """Gain of the cached track at path, measuring it now if needed."""
+        task = self.schedule(path) or self.tasks.get(path)
+        if task:
+            await asyncio.shield(task)
+        return self.gain_for(path)
+
+    async def _analyze(self, path: str):
+        try:
+            async with self.semaphore:
+                process = await asyncio.create_subprocess_exec(
+                    self.ffmpeg, "-nostdin", "-hide_banner", "-i", path,
+                    "-af", f"loudnorm=I={self.target}:print_format=json", "-f", "null", "-",
+                    stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+                )
+                try:
+                    _, stderr = await process.communicate()
+                finally:
+                    if process.returncode is None:
+                        process.kill()
+                        await process.wait()
+            output = stderr.decode("utf-8", "replace")
+            if process.returncode != 0:
+                raise RuntimeError(output.strip().splitlines()[-1] if output.strip() else "ffmpeg failed")
+            gain = self.gain(json.loads(re.findall(r"\{[^{}]*\}", output)[-1]))
+        except Exception as e:
+            self.failed += 1
+            print(f"Error measuring loudness of {path}: {str(e)}")
+            return
+        self.cache.annotate(path, gain_db=gain)
+        self.done += 1
+
+    def gain(self, measured: Dict[str, str]) -> float:
+        """Gain in dB for loudnorm's measurements of a track."""
+        loudness = float(measured["input_i"])
+        if loudness == float("-inf"):
+            # Silence, nothing to normalize.
+            return 0.0
+        gain = min(self.target - loudness, PEAK_CEILING - float(measured["input_tp"]))
+        return round(max(-self.max_gain, min(self.max_gain, gain)), 2)
+
+    def stats(self) -> Dict[str, int]:
+        return {"measuring": len(self.tasks), "done": self.done, "failed": self.failed}
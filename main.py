@@ -1,27 +1,40 @@
+from time import time
+
+# Before the slow imports below, to time startup.
+STARTED_AT = time()
+
 from pyrogram import Client, idle
 from pyrogram.filters import command
-from pytgcalls import PyTgCalls
+from pytgcalls import PyTgCalls, filters as call_filters
 from pytgcalls.types import MediaStream as AudioPiped
+from pytgcalls.exceptions import NoActiveGroupCall, CallBusy, CallDeclined, CallDiscarded
+import asyncio
 import os
-import requests
-import urllib.parse
+import aiohttp
 
 # Assuming config.py is correctly set up
-from config import API_ID, API_HASH, BOT_TOKEN, SESSION_NAME
+from config import API_ID, API_HASH, BOT_TOKEN, SESSION_NAME, PLAY_RETRY_DELAY, PLAY_MAX_FAILURES
+from saavn import SaavnClient
+from track_cache import TrackCache
+from sessions import SessionManager
 
 # Initialize clients
 userbot = Client("userbot_py", api_id=API_ID, api_hash=API_HASH, session_string=SESSION_NAME)
 bot = Client("music_bot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
 pytgcalls = PyTgCalls(userbot)
+saavn = SaavnClient()
+cache = TrackCache(saavn.download, load=False)  # Index read in the background, see warm_cache
+
+sessions = SessionManager()  # Queue and current track of every chat, keyed by chat ID
+track_titles = {}  # Cached file path -> song title, cache files are named by song ID
+cache_warm = None  # Task reading the track cache index, see start
 
-queue = []
-current_track = None
-#CHAT_ID = None  # Store CHAT_ID globally
+# Errors from the call itself rather than the track, retrying another track will not help.
+CALL_ERRORS = (NoActiveGroupCall, CallBusy, CallDeclined, CallDiscarded)
 
 async def is_in_vc(chat_id):
     try:
-        call = await pytgcalls.get_state(chat_id)
-        return call is not None and call.is_running
+        return chat_id in await pytgcalls.calls
     except Exception:
         return False
 
@@ -35,8 +48,7 @@ async def ping_command(client, message):
 
 @bot.on_message(command("join"))
 async def join_vc(client, message):
-    global current_track
-    CHAT_ID = message.chat.id
+    session = sessions.get(message.chat.id)
     save_mp3_path = os.path.join(os.getcwd(), "Maybe.mp3")  # Path to save.mp3 in root directory
 
     # Check if save.mp3 exists
@@ -46,29 +58,28 @@ async def join_vc(client, message):
 
     try:
         # Check if already in VC
-        if await is_in_vc(CHAT_ID):
+        if await is_in_vc(session.chat_id):
             # Add save.mp3 to queue
-            queue.append(save_mp3_path)
+            session.queue.append(save_mp3_path)
             await message.reply("Added Maybe.mp3 to queue!")
-            if not current_track:
-                await play_next()
+            if not session.current_track:
+                await play_next(session)
             return
 
         # Join VC and play save.mp3
-        queue.append(save_mp3_path)
-        await pytgcalls.play(
-            CHAT_ID,
-            AudioPiped(save_mp3_path)
-        )
+        async with session.lock:
+            await pytgcalls.play(
+                session.chat_id,
+                AudioPiped(save_mp3_path)
+            )
+            session.current_track = save_mp3_path
         await message.reply("Joined voice chat and started playing save.mp3!")
-        current_track = save_mp3_path
     except Exception as e:
         await message.reply(f"Error joining VC or playing save.mp3: {str(e)}")
 
 @bot.on_message(command("play"))
 async def play_song(client, message):
-    global current_track
-    CHAT_ID = message.chat.id
+    session = sessions.get(message.chat.id)
     query = " ".join(message.command[1:]) or (message.reply_to_message.text if message.reply_to_message else None)
     if not query:
         await message.reply("Please provide a song name!")
@@ -76,18 +87,15 @@ async def play_song(client, message):
 
     try:
         # Query JioSaavn API
-        url = f"https://jiosaavn-api-privatecvc2.vercel.app/search/songs?query={urllib.parse.quote(query)}"
-        response = requests.get(url)
-        response.raise_for_status()  # Raise exception for bad status
-        data = response.json()
+        results = await saavn.search_songs(query)
 
-        # Check status and results
-        if data.get("status") != "SUCCESS" or not data.get("data", {}).get("results") or len(data["data"]["results"]) == 0:
+        # Check results
+        if not results:
             await message.reply("No results found for your query!")
             return
 
         # Get first result
-        song = data["data"]["results"][0]
+        song = results[0]
         title = song.get("name", "Unknown Title")
         download_urls = song.get("downloadUrl", [])
 
@@ -100,18 +108,16 @@ async def play_song(client, message):
             await message.reply("Invalid download URL for this song!")
             return
 
-        # Download the song
-        file_path = f"downloads/{title}.mp3"
-        with open(file_path, "wb") as f:
-            audio_response = requests.get(download_url)
-            audio_response.raise_for_status()
-            f.write(audio_response.content)
+        # Download the song, or reuse it if it is already cached
+        file_path = await cache.fetch(song["id"], download_urls[-1].get("quality", ""), download_url, title=title)
+        track_titles[file_path] = title
 
-        queue.append(file_path)
+        cache.pin(file_path)
+        session.queue.append(file_path)
         await message.reply(f"Added to queue: {title}")
-        if not current_track:
-            await play_next()
-    except requests.RequestException as e:
+        if not session.current_track:
+            await play_next(session)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         await message.reply(f"Error fetching song from JioSaavn: {str(e)}. Try a different song.")
         return
     except KeyError as e:
@@ -124,67 +130,116 @@ async def play_song(client, message):
         await message.reply(f"Unexpected error: {str(e)}. Try a different song.")
         return
 
-    if not await is_in_vc(CHAT_ID):
+    if session.current_track and not await is_in_vc(session.chat_id):
         try:
             await pytgcalls.play(
-                CHAT_ID,
-                AudioPiped(queue[0])
+                session.chat_id,
+                AudioPiped(session.current_track)
             )
             await message.reply("Joined voice chat and started playback!")
         except Exception as e:
             await message.reply(f"Error joining VC: {str(e)}")
 
-async def play_next():
-    global current_track, CHAT_ID
-    if not queue:
-        current_track = None
+async def play_next(session):
+    async with session.lock:
+        await _play_next(session)
+
+async def _play_next(session):
+    # Skip tracks that fail to play, waiting longer after each one, and
+    # give up after PLAY_MAX_FAILURES in a row. Without a voice chat to
+    # play in the track stays queued.
+    if session.current_track:
+        cache.unpin(session.current_track)
+    failures = 0
+    delay = PLAY_RETRY_DELAY
+    while session.queue:
+        session.current_track = session.queue.popleft()
+        try:
+            await pytgcalls.play(
+                session.chat_id,
+                AudioPiped(session.current_track)
+            )
+        except CALL_ERRORS as e:
+            session.queue.appendleft(session.current_track)
+            session.current_track = None
+            await bot.send_message(session.chat_id, f"Error joining VC: {str(e)}")
+            return
+        except Exception as e:
+            cache.unpin(session.current_track)
+            failures += 1
+            if failures >= PLAY_MAX_FAILURES:
+                session.current_track = None
+                await bot.send_message(session.chat_id, f"Error playing track: {str(e)}. {failures} tracks in a row failed, playback stopped.")
+                return
+            await bot.send_message(session.chat_id, f"Error playing track: {str(e)}. Skipping to the next one in {delay}s.")
+            await asyncio.sleep(delay)
+            delay *= 2
+            continue
+        await bot.send_message(session.chat_id, f"Now playing: {track_titles.get(session.current_track, os.path.basename(session.current_track))}")
         return
-    current_track = queue.pop(0)
-    try:
-        await pytgcalls.play(
-            CHAT_ID,
-            AudioPiped(current_track)
-        )
-        await bot.send_message(CHAT_ID, f"Now playing: {os.path.basename(current_track)}")
-    except Exception as e:
-        await bot.send_message(CHAT_ID, f"Error playing track: {str(e)}")
-        await play_next()
+    session.current_track = None
+
+@pytgcalls.on_update(call_filters.stream_end())
+async def on_stream_end(client, update):
+    # Route the event to the chat whose stream ended
+    session = sessions.find(update.chat_id)
+    if session:
+        await play_next(session)
 
 @bot.on_message(command("skip"))
 async def skip_song(client, message):
-    CHAT_ID = message.chat.id
-    if not current_track:
+    session = sessions.get(message.chat.id)
+    if not session.current_track:
         await message.reply("No song is playing!")
         return
     await message.reply("Skipping current song...")
-    await play_next()
+    await play_next(session)
 
 @bot.on_message(command("stop"))
 async def stop_vc(client, message):
-    global current_track
-    CHAT_ID = message.chat.id
+    session = sessions.get(message.chat.id)
     try:
-        await pytgcalls.leave_call(CHAT_ID)
-        queue.clear()
-        current_track = None
+        await pytgcalls.leave_call(session.chat_id)
+        async with session.lock:
+            for path in ([session.current_track] if session.current_track else []) + list(session.queue):
+                cache.unpin(path)
+            session.queue.clear()
+            session.current_track = None
+            sessions.drop(session.chat_id)
         await message.reply("Stopped and left voice chat!")
     except Exception as e:
         await message.reply(f"Error: {str(e)}")
 
-# Create downloads directory
-if not os.path.exists("downloads"):
-    os.makedirs("downloads")
+async def warm_cache():
+    # Reading the index stats every cached file, keep it off the event loop.
+    try:
+        cache.load(await asyncio.to_thread(cache.read))
+        print(f">>> TRACK CACHE READY: {len(cache.entries)} tracks")
+    except Exception as e:
+        print(f"Error reading track cache: {str(e)}")
+
+async def start():
+    global cache_warm
+    cache_warm = asyncio.create_task(warm_cache())
+    # pytgcalls.start() also starts the userbot, both log in alongside the bot.
+    await asyncio.gather(bot.start(), pytgcalls.start())
 
 # Start the bot
 try:
-    userbot.start()
-    bot.start()
-    pytgcalls.start()
-    print(">>> MUSIC BOT STARTED")
+    asyncio.get_event_loop().run_until_complete(start())
+    print(f">>> MUSIC BOT STARTED in {time() - STARTED_AT:.2f}s")
     idle()  # Keep the bot running
 except Exception as e:
     print(f"Error during bot execution: {e}")
 finally:
+    try:
+        cache.flush()
+    except Exception as e:
+        print(f"Error saving track cache index: {e}")
+    try:
+        asyncio.get_event_loop().run_until_complete(saavn.close())
+    except Exception as e:
+        print(f"Error closing HTTP session: {e}")
     try:
         pytgcalls.stop()
     except Exception as e:
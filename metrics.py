@@ -0,0 +1,141 @@
+import asyncio
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from aiohttp import web
+
+LabelKey = Tuple[Tuple[str, str], ...]
+GaugeValue = Union[float, Dict[LabelKey, float]]
+
+
+def labels(**values) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in values.items()))
+
+
+def _format_labels(key: LabelKey) -> str:
+    if not key:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in key)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + "}"
+
+
+class Metrics:
+    """Counters, timers and gauges for the bot's hot paths.
+
+    Counters and timers are updated in place by the code they measure.
+    Gauges are read when rendering: each is a callable returning a number,
+    or a dict of label keys (see `labels`) to numbers for per-chat values.
+    A gauge reading a total kept elsewhere (cache hits, downloaded bytes)
+    is registered with kind="counter" so Prometheus treats it as one.
+    `render` writes everything in the Prometheus text format, every name
+    prefixed with `prefix`.
+    """
+
+    def __init__(self, prefix: str = "musicbot"):
+        self.prefix = prefix
+        self.counters: Dict[str, Dict[LabelKey, float]] = {}
+        # name -> labels -> [count, total seconds, max seconds]
+        self.timers: Dict[str, Dict[LabelKey, List[float]]] = {}
+        self.gauges: Dict[str, Tuple[Callable[[], GaugeValue], str]] = {}
+        self.help: Dict[str, str] = {}
+        self.loop_lag = 0.0
+        self.loop_lag_max = 0.0
+        self.gauge("event_loop_lag_seconds", lambda: self.loop_lag, "Delay of the last event loop wake-up")
+        self.gauge("event_loop_lag_max_seconds", lambda: self.loop_lag_max, "Worst event loop wake-up delay")
+
+    def inc(self, name: str, value: float = 1, **label_values):
+        series = self.counters.setdefault(name, {})
+        key = labels(**label_values)
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **label_values):
+        stats = self.timers.setdefault(name, {}).setdefault(labels(**label_values), [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+
+    @contextmanager
+    def timer(self, name: str, **label_values):
+        """Time the block into the `name` timer, also when it raises."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start, **label_values)
+
+    def gauge(self, name: str, read: Callable[[], GaugeValue], help: str = "", kind: str = "gauge"):
+        self.gauges[name] = (read, kind)
+        if help:
+            self.help[name] = help
+
+    def describe(self, name: str, help: str):
+        self.help[name] = help
+
+    def count(self, name: str) -> float:
+        """Total of a counter over all its labels."""
+        return sum(self.counters.get(name, {}).values())
+
+    def timing(self, name: str) -> Optional[Tuple[int, float, float]]:
+        """(count, average, max) seconds of a timer over all its labels."""
+        series = self.timers.get(name)
+        if not series:
+            return None
+        count = sum(stats[0] for stats in series.values())
+        total = sum(stats[1] for stats in series.values())
+        return count, total / count if count else 0.0, max(stats[2] for stats in series.values())
+
+    def render(self) -> str:
+        lines = []
+
+        def header(name: str, kind: str):
+            full = f"{self.prefix}_{name}"
+            if name in self.help:
+                lines.append(f"# HELP {full} {self.help[name]}")
+            lines.append(f"# TYPE {full} {kind}")
+            return full
+
+        for name, series in self.counters.items():
+            full = header(name, "counter")
+            for key, value in series.items():
+                lines.append(f"{full}{_format_labels(key)} {value}")
+        for name, series in self.timers.items():
+            full = header(name, "summary")
+            for key, (count, total, worst) in series.items():
+                lines.append(f"{full}_count{_format_labels(key)} {count}")
+                lines.append(f"{full}_sum{_format_labels(key)} {total}")
+            lines.append(f"# TYPE {full}_max gauge")
+            for key, (count, total, worst) in series.items():
+                lines.append(f"{full}_max{_format_labels(key)} {worst}")
+        for name, (read, kind) in self.gauges.items():
+            try:
+                value = read()
+            except Exception as e:
+                print(f"Error reading metric {name}: {str(e)}")
+                continue
+            full = header(name, kind)
+            for key, number in (value.items() if isinstance(value, dict) else [((), value)]):
+                lines.append(f"{full}{_format_labels(key)} {number}")
+        return "\n".join(lines) + "\n"
+
+    async def watch_loop_lag(self, interval: float = 1.0):
+        """Measure how late the event loop wakes from a sleep, forever."""
+        while True:
+            start = perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag = max(0.0, perf_counter() - start - interval)
+            self.loop_lag_max = max(self.loop_lag_max, self.loop_lag)
+
+
+async def serve(metrics: Metrics, host: str, port: int) -> web.AppRunner:
+    """Serve metrics.render() at http://host:port/metrics, cleanup() the runner to stop."""
+
+    async def handle(request: web.Request):
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,197 @@
+import asyncio
+from collections import deque
+from time import monotonic
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from pyrogram.errors import FloodWait, MessageNotModified
+
+from config import (
+    OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_GLOBAL_RATE, OUTBOX_COALESCE_WINDOW, OUTBOX_MAX_RETRIES,
+)
+
+
+class TokenBucket:
+    """Allows `rate` actions per second on average, up to `burst` at once."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+
+    def wait(self) -> float:
+        """Seconds until a token is available, 0 if one is now."""
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Job:
+    __slots__ = ("key", "send", "text", "kwargs", "future", "retries")
+
+    def __init__(self, key: Optional[str], send: Optional[Callable[[], Awaitable[Any]]], text: str, kwargs: dict):
+        self.key = key
+        self.send = send
+        self.text = text
+        self.kwargs = kwargs
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.retries = 0
+
+
+class _Chat:
+    __slots__ = ("jobs", "pending", "bucket", "paused_until", "worker", "statuses")
+
+    def __init__(self, rate: float, burst: float):
+        self.jobs: Deque[_Job] = deque()
+        self.pending: Dict[str, _Job] = {}
+        self.bucket = TokenBucket(rate, burst)
+        self.paused_until = 0.0
+        self.worker: Optional[asyncio.Task] = None
+        # Status key -> (message id, when it was last sent or edited).
+        self.statuses: Dict[str, Tuple[int, float]] = {}
+
+
+class Outbox:
+    """Sends the bot's messages from a background worker per chat.
+
+    Handlers queue a message and return at once, the returned future
+    resolves to the sent message. Each chat is paced by a token bucket
+    (`chat_rate` per second, `burst` at once) under a bot-wide one, and a
+    FloodWait pauses only its chat before the message is retried.
+
+    Jobs queued with a key replace the queued, not yet sent, job with
+    that key. `status` messages go further: within `window` seconds of
+    the last one with the same key, the message already sent is edited
+    instead of a new one being posted.
+    """
+
+    def __init__(self, client, metrics=None, chat_rate: float = OUTBOX_CHAT_RATE, burst: float = OUTBOX_CHAT_BURST,
+                 global_rate: float = OUTBOX_GLOBAL_RATE, window: float = OUTBOX_COALESCE_WINDOW,
+                 max_retries: int = OUTBOX_MAX_RETRIES):
+        self.client = client
+        self.metrics = metrics
+        self.chat_rate = chat_rate
+        self.burst = burst
+        self.bucket = TokenBucket(global_rate, global_rate)
+        self.window = window
+        self.max_retries = max_retries
+        self.chats: Dict[int, _Chat] = {}
+        self.sent = 0
+        self.coalesced = 0
+        self.flood_waits = 0
+
+    def submit(self, chat_id: int, send: Callable[[], Awaitable[Any]], key: Optional[str] = None) -> asyncio.Future:
+        """Queue send() for chat_id, replacing the queued job with the same key."""
+        return self._queue(chat_id, key, send, "", {})
+
+    def status(self, chat_id: int, key: str, text: str, **kwargs) -> asyncio.Future:
+        """Post text, or edit the recent message posted under key into it."""
+        return self._queue(chat_id, key, None, text, kwargs)
+
+    def _queue(self, chat_id: int, key: Optional[str], send, text: str, kwargs: dict) -> asyncio.Future:
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            self._sweep()
+            chat = self.chats[chat_id] = _Chat(self.chat_rate, self.burst)
+        job = chat.pending.get(key) if key is not None else None
+        if job is not None:
+            job.send, job.text, job.kwargs = send, text, kwargs
+            self.coalesced += 1
+        else:
+            job = _Job(key, send, text, kwargs)
+            chat.jobs.append(job)
+            if key is not None:
+                chat.pending[key] = job
+        if chat.worker is None:
+            chat.worker = asyncio.create_task(self._run(chat_id, chat))
+        return job.future
+
+    async def _run(self, chat_id: int, chat: _Chat):
+        try:
+            while chat.jobs:
+                delay = max(chat.bucket.wait(), self.bucket.wait(), chat.paused_until - monotonic())
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                chat.bucket.take()
+                self.bucket.take()
+                job = chat.jobs.popleft()
+                if job.key is not None and chat.pending.get(job.key) is job:
+                    del chat.pending[job.key]
+                try:
+                    result = await self._deliver(chat_id, chat, job)
+                except FloodWait as e:
+                    self.flood_waits += 1
+                    chat.paused_until = monotonic() + int(e.value or 1)
+                    if job.retries < self.max_retries:
+                        job.retries += 1
+                        self._requeue(chat, job)
+                        continue
+                    job.future.set_exception(e)
+                    job.future.exception()
+                except Exception as e:
+                    print(f"Error sending message to {chat_id}: {str(e)}")
+                    job.future.set_exception(e)
+                    job.future.exception()
+                else:
+                    self.sent += 1
+                    job.future.set_result(result)
+        finally:
+            chat.worker = None
+
+    def _sweep(self):
+        """Forget idle chats whose status messages are too old to edit."""
+        now = monotonic()
+        for chat_id, chat in list(self.chats.items()):
+            if chat.worker is None and not chat.jobs and all(now - sent[1] >= self.window for sent in chat.statuses.values()):
+                del self.chats[chat_id]
+
+    def _requeue(self, chat: _Chat, job: _Job):
+        """Put a job back at the front, unless a newer one with its key was queued meanwhile."""
+        if job.key is not None:
+            if job.key in chat.pending:
+                job.future.set_result(None)
+                return
+            chat.pending[job.key] = job
+        chat.jobs.appendleft(job)
+
+    async def _deliver(self, chat_id: int, chat: _Chat, job: _Job):
+        start = monotonic()
+        kind = "send" if job.send else "status"
+        try:
+            if job.send:
+                return await job.send()
+            sent = chat.statuses.get(job.key)
+            if sent and start - sent[1] < self.window:
+                kind = "edit"
+                try:
+                    message = await self.client.edit_message_text(chat_id, sent[0], job.text, **job.kwargs)
+                except MessageNotModified:
+                    message = None
+                except FloodWait:
+                    raise
+                except Exception:
+                    # The message is gone, post a new one.
+                    kind = "status"
+                    message = await self.client.send_message(chat_id, job.text, **job.kwargs)
+            else:
+                message = await self.client.send_message(chat_id, job.text, **job.kwargs)
+            message_id = getattr(message, "id", None) or (sent[0] if sent else None)
+            if message_id:
+                chat.statuses[job.key] = (message_id, monotonic())
+            return message
+        finally:
+            if self.metrics:
+                self.metrics.observe("outbox_delivery_seconds", monotonic() - start, kind=kind)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": sum(len(chat.jobs) for chat in self.chats.values()),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "flood_waits": self.flood_waits,
+        }
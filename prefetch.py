@@ -0,0 +1,91 @@
+import asyncio
+from typing import Any, Dict, Optional, Set
+
+from config import PREFETCH_DEPTH, PREFETCH_CONCURRENCY
+from track_cache import TrackCache
+
+
+class Prefetcher:
+    """Downloads the next few queued tracks of every chat in the background.
+
+    Queued tracks only carry metadata (song_id, quality, url). Once a
+    download finishes its file is pinned in the cache and `track.path` is
+    set; `release` undoes that or cancels the download when the track is
+    played out or removed from the queue. Every downloaded track is also
+    queued for a loudness scan and conversion to raw PCM when a
+    LoudnessAnalyzer or Transcoder is attached.
+    """
+
+    def __init__(self, cache: TrackCache, depth: int = PREFETCH_DEPTH, concurrency: int = PREFETCH_CONCURRENCY,
+                 transcoder=None, loudness=None):
+        self.cache = cache
+        self.transcoder = transcoder
+        self.loudness = loudness
+        self.depth = depth
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self._started: Set[int] = set()
+
+    def schedule(self, session):
+        for track in session.queue.peek(self.depth):
+            self.prefetch(track)
+
+    def prefetch(self, track) -> Optional[asyncio.Task]:
+        """Start downloading track, returns its download task unless it is ready."""
+        if track.path:
+            return None
+        task = self.tasks.get(id(track))
+        if task is None:
+            task = asyncio.create_task(self._prefetch(track))
+            self.tasks[id(track)] = task
+            task.add_done_callback(lambda t, key=id(track): self._forget(key, t))
+        return task
+
+    async def ensure(self, track) -> str:
+        """Path of the track, downloading it now if the prefetch has not."""
+        if track.path:
+            return track.path
+        task = self.tasks.get(id(track))
+        if task and id(track) in self._started:
+            try:
+                return await asyncio.shield(task)
+            except Exception:
+                pass
+        elif task:
+            # Still waiting for a download slot, it is needed now.
+            task.cancel()
+        return await self._fetch(track)
+
+    def release(self, track):
+        task = self.tasks.get(id(track))
+        if task:
+            task.cancel()
+        if track.path and track.song_id:
+            self.cache.unpin(track.path)
+
+    async def _prefetch(self, track) -> str:
+        async with self.semaphore:
+            self._started.add(id(track))
+            return await self._fetch(track)
+
+    async def _fetch(self, track) -> str:
+        path = await self.cache.fetch(track.song_id, track.quality, track.url, title=track.title,
+                                       artist=track.artist, duration=track.duration)
+        if not track.path:
+            track.path = path
+            self.cache.pin(path)
+        if self.loudness:
+            self.loudness.schedule(path)
+        if self.transcoder:
+            self.transcoder.schedule(path)
+        return track.path
+
+    def _forget(self, key: int, task: asyncio.Task):
+        if self.tasks.get(key) is task:
+            del self.tasks[key]
+            self._started.discard(key)
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"pending": len(self.tasks), "downloading": len(self._started)}
@@ -0,0 +1,190 @@
+import asyncio
+import os
+import tempfile
+import urllib.parse
+from collections import OrderedDict
+from time import monotonic, perf_counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from config import (
+    SAAVN_API_URL, HTTP_POOL_SIZE, HTTP_PER_HOST_LIMIT, HTTP_TIMEOUT, DOWNLOAD_READ_TIMEOUT, DOWNLOAD_CHUNK_SIZE,
+    SEARCH_CACHE_TTL, SEARCH_CACHE_SIZE,
+)
+
+
+def best_download(song: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    """Highest quality downloadUrl entry of a song, the API lists it last."""
+    urls = song.get("downloadUrl") or []
+    if not urls or not urls[-1].get("link"):
+        return None
+    return urls[-1]
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.casefold().split())
+
+
+class SearchCache:
+    """Bounded LRU of search results that expire after `ttl` seconds."""
+
+    def __init__(self, ttl: float = SEARCH_CACHE_TTL, max_size: int = SEARCH_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries: "OrderedDict[str, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, results: List[Dict[str, Any]]):
+        self.entries[key] = (monotonic() + self.ttl, results)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+class SaavnClient:
+    """Async JioSaavn client sharing one keep-alive connection pool.
+
+    The aiohttp session is created lazily so it binds to the loop the bot
+    is actually running on.
+    """
+
+    def __init__(self, base_url: str = SAAVN_API_URL, pool_size: int = HTTP_POOL_SIZE,
+                 per_host: int = HTTP_PER_HOST_LIMIT, timeout: float = HTTP_TIMEOUT,
+                 read_timeout: float = DOWNLOAD_READ_TIMEOUT, chunk_size: int = DOWNLOAD_CHUNK_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.per_host = per_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.download_timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=read_timeout)
+        self.chunk_size = chunk_size
+        self.search_cache = SearchCache()
+        self._searches: Dict[str, asyncio.Future] = {}
+        self.downloads = 0
+        self.downloaded_bytes = 0
+        self.download_seconds = 0.0
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.per_host,
+                ttl_dns_cache=300,
+                keepalive_timeout=30,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout, raise_for_status=True)
+        return self._session
+
+    async def get_json(self, path: str) -> Dict[str, Any]:
+        async with self.session().get(f"{self.base_url}{path}") as response:
+            return await response.json(content_type=None)
+
+    async def search_songs(self, query: str) -> List[Dict[str, Any]]:
+        """Search results for query, memoized by normalized query.
+
+        Identical searches already in flight are awaited instead of being
+        sent upstream again. Failures are not cached.
+        """
+        key = normalize_query(query)
+        results = self.search_cache.get(key)
+        if results is not None:
+            return results
+        pending = self._searches.get(key)
+        if pending:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+            # Whoever started the search gave up on it, search again.
+            return await self.search_songs(query)
+        future = asyncio.get_running_loop().create_future()
+        self._searches[key] = future
+        try:
+            data = await self.get_json(f"/search/songs?query={urllib.parse.quote(key)}")
+            results = []
+            if data.get("status") == "SUCCESS":
+                results = data.get("data", {}).get("results") or []
+            self.search_cache.put(key, results)
+            future.set_result(results)
+            return results
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            del self._searches[key]
+
+    async def get_song(self, song_id: str) -> Optional[Dict[str, Any]]:
+        """Full song object by ID, with fresh downloadUrl entries."""
+        data = await self.get_json(f"/songs?id={urllib.parse.quote(song_id)}")
+        if data.get("status") != "SUCCESS":
+            return None
+        songs = data.get("data") or []
+        return songs[0] if songs else None
+
+    async def get_collection(self, kind: str, id_or_link: str) -> Optional[Dict[str, Any]]:
+        """A playlist or album with all its songs, in a single request.
+
+        kind is "playlist" or "album"; accepts an ID or a jiosaavn.com link.
+        """
+        param = "link" if id_or_link.startswith("http") else "id"
+        data = await self.get_json(f"/{kind}s?{param}={urllib.parse.quote(id_or_link)}")
+        if data.get("status") != "SUCCESS":
+            return None
+        return data.get("data")
+
+    async def fetch_bytes(self, url: str, limit: int = 4 * 1024 * 1024) -> bytes:
+        """Small files (cover images) read straight into memory, up to limit bytes."""
+        async with self.session().get(url) as response:
+            data = await response.content.read(limit + 1)
+        if len(data) > limit:
+            raise ValueError(f"{url} is larger than {limit} bytes")
+        return data
+
+    async def download(self, url: str, path: str) -> str:
+        """Stream url into path, at most chunk_size bytes in memory at a time.
+
+        Data lands in a .part file next to path and is renamed over it only
+        once complete, so readers never see a truncated track.
+        """
+        fd, part_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".part")
+        start = perf_counter()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async with self.session().get(url, timeout=self.download_timeout, read_bufsize=self.chunk_size) as response:
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        f.write(chunk)
+                        self.downloaded_bytes += len(chunk)
+            os.replace(part_path, path)
+        except BaseException:
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+            raise
+        finally:
+            self.download_seconds += perf_counter() - start
+        self.downloads += 1
+        return path
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
@@ -0,0 +1,196 @@
+import asyncio
+import random
+from collections import deque
+from itertools import islice
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+
+class TrackQueue:
+    """Upcoming tracks of a chat.
+
+    Backed by a deque so taking the next track and appending are O(1).
+    Positions in the editing methods are 0-based; the bot commands
+    translate from the 1-based numbers shown in /queue. Every change is
+    reported to `store` (a SessionStore) when one is attached.
+    """
+
+    def __init__(self, chat_id: int = 0, store=None):
+        self.chat_id = chat_id
+        self.store = store
+        self._items: Deque[Any] = deque()
+
+    def _replaced(self):
+        if self.store:
+            self.store.replaced(self.chat_id, list(self._items))
+
+    def append(self, track: Any):
+        self._items.append(track)
+        if self.store:
+            self.store.appended(self.chat_id, [track])
+
+    def appendleft(self, track: Any):
+        self._items.appendleft(track)
+        self._replaced()
+
+    def extend(self, tracks):
+        tracks = list(tracks)
+        self._items.extend(tracks)
+        if self.store:
+            self.store.appended(self.chat_id, tracks)
+
+    def popleft(self) -> Any:
+        track = self._items.popleft()
+        if self.store:
+            self.store.popped(self.chat_id)
+        return track
+
+    def peek(self, count: int) -> List[Any]:
+        return list(islice(self._items, count))
+
+    def page(self, start: int, count: int) -> List[Any]:
+        return list(islice(self._items, start, start + count))
+
+    def remove(self, position: int) -> Any:
+        track = self._items[position]
+        del self._items[position]
+        self._replaced()
+        return track
+
+    def move(self, source: int, target: int):
+        track = self._items[source]
+        del self._items[source]
+        self._items.insert(target, track)
+        self._replaced()
+
+    def shuffle(self):
+        items = list(self._items)
+        random.shuffle(items)
+        self._items = deque(items)
+        self._replaced()
+
+    def clear_range(self, start: int, stop: int) -> List[Any]:
+        """Remove and return the tracks at positions start..stop-1."""
+        stop = min(stop, len(self._items))
+        if start >= stop:
+            return []
+        self._items.rotate(-start)
+        removed = [self._items.popleft() for _ in range(stop - start)]
+        self._items.rotate(start)
+        self._replaced()
+        return removed
+
+    def clear(self) -> List[Any]:
+        removed = list(self._items)
+        self._items.clear()
+        self._replaced()
+        return removed
+
+    def __getitem__(self, position: int) -> Any:
+        return self._items[position]
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __bool__(self) -> bool:
+        return bool(self._items)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._items)
+
+
+class ChatSession:
+    """Playback state of one voice chat: its queue and current track."""
+
+    # Track changes whose gap is kept for the average.
+    GAP_HISTORY = 50
+
+    def __init__(self, chat_id: int, store=None):
+        self.chat_id = chat_id
+        self.store = store
+        self.queue = TrackQueue(chat_id, store)
+        self._current_track: Optional[Any] = None
+        # Seconds from asking for the current track to its stream starting.
+        self.time_to_audio: Optional[float] = None
+        # Milliseconds of silence at recent track changes, 0 when they were spliced.
+        self.gaps: Deque[float] = deque(maxlen=self.GAP_HISTORY)
+        self.stream_ended_at: Optional[float] = None
+        # Serializes track changes, a stream end and a /skip can race otherwise.
+        self.lock = asyncio.Lock()
+
+    @property
+    def current_track(self) -> Optional[Any]:
+        return self._current_track
+
+    @current_track.setter
+    def current_track(self, track: Optional[Any]):
+        self._current_track = track
+        if self.store:
+            self.store.set_current(self.chat_id, track)
+
+    def record_gap(self, started_at: float):
+        """Note the next track starting at started_at after the last stream ended."""
+        if self.stream_ended_at is not None:
+            self.gaps.append(max(0.0, (started_at - self.stream_ended_at) * 1000))
+            self.stream_ended_at = None
+
+    @property
+    def average_gap(self) -> Optional[float]:
+        return sum(self.gaps) / len(self.gaps) if self.gaps else None
+
+    @property
+    def idle(self) -> bool:
+        return self.current_track is None and not self.queue
+
+
+class SessionManager:
+    """Registry of per-chat sessions, created on first use.
+
+    With a SessionStore attached every session persists its changes, and
+    `restore` rebuilds the sessions saved by a previous run.
+    """
+
+    def __init__(self, store=None):
+        self.store = store
+        self.sessions: Dict[int, ChatSession] = {}
+
+    def get(self, chat_id: int) -> ChatSession:
+        session = self.sessions.get(chat_id)
+        if session is None:
+            session = self.sessions[chat_id] = ChatSession(chat_id, self.store)
+        return session
+
+    def restore(self) -> List[ChatSession]:
+        """Sessions from the store, with the interrupted track first in the queue.
+
+        Chats that already have a session keep it, and the store is made
+        to match it again.
+        """
+        restored = []
+        for chat_id, (current, tracks) in self.store.load().items():
+            live = self.sessions.get(chat_id)
+            if live is not None:
+                self.store.replaced(chat_id, list(live.queue))
+                self.store.set_current(chat_id, live.current_track)
+                continue
+            session = self.get(chat_id)
+            session.queue.store = None
+            session.queue.extend(([current] if current else []) + tracks)
+            session.queue.store = self.store
+            self.store.replaced(chat_id, list(session.queue))
+            session.current_track = None
+            restored.append(session)
+        return restored
+
+    def find(self, chat_id: int) -> Optional[ChatSession]:
+        return self.sessions.get(chat_id)
+
+    def drop(self, chat_id: int) -> Optional[ChatSession]:
+        if self.store:
+            self.store.dropped(chat_id)
+        return self.sessions.pop(chat_id, None)
+
+    def __iter__(self) -> Iterator[ChatSession]:
+        return iter(list(self.sessions.values()))
+
+    def __len__(self) -> int:
+        return len(self.sessions)
@@ -0,0 +1,84 @@
+import json
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import STATE_DB_PATH
+from tracks import Track
+
+
+class SessionStore:
+    """SQLite copy of every chat's queue and current track.
+
+    Each queue mutation is written as it happens: appends and pops touch
+    one row, while rarer edits (remove, move, shuffle, clear) rewrite that
+    chat's rows. Rows are ordered by their autoincrement id, so the
+    queue order is simply insertion order.
+    """
+
+    def __init__(self, path: str = STATE_DB_PATH):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (chat_id INTEGER PRIMARY KEY, current_track TEXT)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS queue (id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER, track TEXT)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS queue_chat ON queue (chat_id, id)")
+        self.db.commit()
+
+    @staticmethod
+    def _encode(track: Track) -> str:
+        return json.dumps(track.to_state(), ensure_ascii=False)
+
+    def appended(self, chat_id: int, tracks: List[Track]):
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO queue (chat_id, track) VALUES (?, ?)",
+                [(chat_id, self._encode(track)) for track in tracks],
+            )
+
+    def popped(self, chat_id: int):
+        with self.db:
+            self.db.execute(
+                "DELETE FROM queue WHERE id = (SELECT MIN(id) FROM queue WHERE chat_id = ?)", (chat_id,)
+            )
+
+    def replaced(self, chat_id: int, tracks: List[Track]):
+        with self.db:
+            self.db.execute("DELETE FROM queue WHERE chat_id = ?", (chat_id,))
+            self.db.executemany(
+                "INSERT INTO queue (chat_id, track) VALUES (?, ?)",
+                [(chat_id, self._encode(track)) for track in tracks],
+            )
+
+    def set_current(self, chat_id: int, track: Optional[Track]):
+        with self.db:
+            self.db.execute(
+                "INSERT INTO sessions (chat_id, current_track) VALUES (?, ?) "
+                "ON CONFLICT (chat_id) DO UPDATE SET current_track = excluded.current_track",
+                (chat_id, self._encode(track) if track else None),
+            )
+
+    def dropped(self, chat_id: int):
+        with self.db:
+            self.db.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,))
+            self.db.execute("DELETE FROM queue WHERE chat_id = ?", (chat_id,))
+
+    def load(self) -> Dict[int, Tuple[Optional[Track], List[Track]]]:
+        """Saved state as chat_id -> (current track, queued tracks)."""
+        state: Dict[int, Tuple[Optional[Track], List[Track]]] = {}
+        for chat_id, current in self.db.execute("SELECT chat_id, current_track FROM sessions"):
+            state[chat_id] = (Track.from_state(json.loads(current)) if current else None, [])
+        for chat_id, track in self.db.execute("SELECT chat_id, track FROM queue ORDER BY id"):
+            state.setdefault(chat_id, (None, []))[1].append(Track.from_state(json.loads(track)))
+        return {chat_id: entry for chat_id, entry in state.items() if entry[0] or entry[1]}
+
+    def close(self):
+        self.db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        sessions, = self.db.execute("SELECT COUNT(*) FROM sessions").fetchone()
+        queued, = self.db.execute("SELECT COUNT(*) FROM queue").fetchone()
+        return {"sessions": sessions, "queued": queued}
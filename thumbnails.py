@@ -0,0 +1,52 @@
+import asyncio
+from io import BytesIO
+from typing import Optional, Union
+
+from PIL import Image
+
+from config import THUMBNAIL_SIZE
+from saavn import SaavnClient
+from track_cache import TrackCache
+
+
+class Thumbnails:
+    """Now-playing card images.
+
+    The first announcement of a song downloads its cover once, shrinks it
+    to THUMBNAIL_SIZE and uploads it from memory. The Telegram file_id of
+    that upload is kept in the track cache metadata, so every later card
+    for the song is sent by file_id with nothing fetched or uploaded.
+    """
+
+    def __init__(self, saavn: SaavnClient, cache: TrackCache, size: int = THUMBNAIL_SIZE):
+        self.saavn = saavn
+        self.cache = cache
+        self.size = size
+
+    async def photo(self, track) -> Optional[Union[str, BytesIO]]:
+        """A file_id, an in-memory JPEG to upload, or None if the song has no cover."""
+        if track.song_id:
+            file_id = self.cache.metadata_for(track.song_id).get("thumb_file_id")
+            if file_id:
+                return file_id
+        if not track.thumbnail:
+            return None
+        data = await self.saavn.fetch_bytes(track.thumbnail)
+        return await asyncio.to_thread(self._resize, data)
+
+    def _resize(self, data: bytes) -> BytesIO:
+        image = Image.open(BytesIO(data)).convert("RGB")
+        image.thumbnail((self.size, self.size))
+        card = BytesIO()
+        image.save(card, "JPEG", quality=85, optimize=True)
+        card.name = "cover.jpg"
+        card.seek(0)
+        return card
+
+    def remember(self, track, sent):
+        if track.song_id and sent is not None and getattr(sent, "photo", None):
+            self.cache.update_metadata(track.song_id, thumb_file_id=sent.photo.file_id)
+
+    def forget(self, track):
+        if track.song_id:
+            self.cache.update_metadata(track.song_id, thumb_file_id=None)
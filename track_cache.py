@@ -0,0 +1,381 @@
+import asyncio
+import json
+import os
+import re
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from config import TRACK_CACHE_DIR, TRACK_CACHE_MAX_MB, TRACK_CACHE_SAVE_DELAY, TRACK_METADATA_SIZE
+
+
+class TrackCache:
+    """On-disk MP3 cache keyed by JioSaavn song ID and quality.
+
+    Entries live in `directory` as `<song_id>_<quality>.mp3` and are tracked
+    in `index.json` in least-recently-used order. When the total size goes
+    over `max_bytes` the oldest entries that are not pinned (queued or
+    playing) are deleted.
+
+    A track may also have a raw PCM copy, `<song_id>_<quality>.pcm`, made
+    by the Transcoder. It counts towards the same budget and is evicted
+    together with its MP3.
+
+    It also remembers per-song metadata (album, thumbnail) for Track: kept
+    in memory for the most recent `TRACK_METADATA_SIZE` songs and written
+    to the index with the entry once a song is downloaded.
+
+    `listener`, if set, is told of entries coming and going through its
+    `added(key, entry)` and `removed(key)` methods.
+
+    With load=False the index is not read at construction: call `read()`
+    (which touches no state, so it may run in a thread) and then
+    `load(entries)`. The cache works meanwhile, without the older entries.
+
+    Changes to the index are written `save_delay` seconds later, together;
+    call `flush()` at shutdown.
+    """
+
+    METADATA_FIELDS = ("album", "thumbnail", "thumb_file_id")
+
+    INDEX_NAME = "index.json"
+
+    def __init__(self, downloader: Callable[[str, str], Awaitable[str]], directory: str = TRACK_CACHE_DIR,
+                 max_bytes: int = TRACK_CACHE_MAX_MB * 1024 * 1024, load: bool = True,
+                 save_delay: float = TRACK_CACHE_SAVE_DELAY):
+        self.downloader = downloader
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.save_delay = save_delay
+        self.index_path = os.path.join(directory, self.INDEX_NAME)
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.metadata: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.quarantined = 0
+        self._pins: Dict[str, int] = {}
+        # Quarantined files still pinned, deleted on their last unpin.
+        self._condemned = set()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._dirty = False
+        self._save_task: Optional[asyncio.Task] = None
+        self.listener = None
+        self.loaded = False
+        if load:
+            self.load()
+
+    @staticmethod
+    def key(song_id: str, quality: str) -> str:
+        return re.sub(r"[^A-Za-z0-9_-]", "_", f"{song_id}_{quality}")
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def raw_path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pcm")
+
+    @staticmethod
+    def key_of(path: str) -> str:
+        return os.path.splitext(os.path.basename(path))[0]
+
+    @staticmethod
+    def _bytes(entry: Dict[str, Any]) -> int:
+        return entry["size"] + entry.get("raw_size", 0)
+
+    def read(self) -> List[Dict[str, Any]]:
+        """Entries of the index on disk whose files still exist, sized from disk."""
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = []
+        found = []
+        for entry in entries:
+            path = self.path_for(entry["key"])
+            if os.path.exists(path):
+                entry["size"] = os.path.getsize(path)
+                raw_path = self.raw_path_for(entry["key"])
+                if os.path.exists(raw_path):
+                    entry["raw_size"] = os.path.getsize(raw_path)
+                else:
+                    entry.pop("raw_size", None)
+                found.append(entry)
+        return found
+
+    def load(self, entries: Optional[List[Dict[str, Any]]] = None):
+        """Take in the entries from read(), reading them now if not given.
+
+        Songs cached since the cache was created are newer than the index
+        and keep their entries. The listener is not told, the index is
+        usually built from `entries` afterwards.
+        """
+        loaded: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        for entry in self.read() if entries is None else entries:
+            if entry["key"] in self.entries:
+                continue
+            loaded[entry["key"]] = entry
+            self.total_bytes += self._bytes(entry)
+            if entry.get("song_id") and entry["song_id"] not in self.metadata:
+                self.metadata[entry["song_id"]] = {
+                    field: entry[field] for field in self.METADATA_FIELDS if field in entry
+                }
+        loaded.update(self.entries)
+        self.entries = loaded
+        self.loaded = True
+        self.save()
+
+    def save(self):
+        """Write the index in save_delay seconds, in a thread, with every change made until then.
+
+        Without a running loop it is written straight away.
+        """
+        if not self._dirty or self._save_task:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        self._save_task = loop.create_task(self._save_later())
+
+    async def _save_later(self):
+        try:
+            await asyncio.sleep(self.save_delay)
+            if not self.loaded:
+                # Writing the index before reading it would lose the older
+                # entries, load() saves again once they are in.
+                return
+            # Copies, the entries may change while the thread writes them.
+            entries = [dict(entry) for entry in self.entries.values()]
+            self._dirty = False
+            await asyncio.to_thread(self._write, entries)
+        except Exception as e:
+            self._dirty = True
+            print(f"Error saving track cache index: {str(e)}")
+        finally:
+            if self._save_task is asyncio.current_task():
+                self._save_task = None
+        # Changed while it was being written.
+        self.save()
+
+    def flush(self):
+        """Write the index now if it changed, for shutdown."""
+        if self._save_task:
+            self._save_task.cancel()
+            self._save_task = None
+        if self._dirty and not self.loaded:
+            self.load()
+        if self._dirty:
+            self._write(list(self.entries.values()))
+            self._dirty = False
+
+    def _write(self, entries: List[Dict[str, Any]]):
+        part_path = f"{self.index_path}.part"
+        with open(part_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False)
+        os.replace(part_path, self.index_path)
+
+    def lookup(self, song_id: str, quality: str) -> Optional[str]:
+        key = self.key(song_id, quality)
+        if key not in self.entries:
+            return None
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            self._drop(key)
+            return None
+        self.entries.move_to_end(key)
+        self._dirty = True
+        return path
+
+    async def fetch(self, song_id: str, quality: str, url: str, **meta) -> str:
+        """Return the cached file for the song, downloading it on a miss.
+
+        Concurrent requests for the same song share one download.
+        """
+        path = self.lookup(song_id, quality)
+        if path:
+            self.hits += 1
+            return path
+        key = self.key(song_id, quality)
+        pending = self._pending.get(key)
+        if pending:
+            self.hits += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+            # Whoever started the download gave up on it, start another.
+            return await self.fetch(song_id, quality, url, **meta)
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            path = await self.downloader(url, self.path_for(key))
+            self.put(key, path, song_id=song_id, quality=quality, url=url, **self.metadata_for(song_id), **meta)
+            future.set_result(path)
+            return path
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            del self._pending[key]
+
+    def put(self, key: str, path: str, **meta):
+        if key in self.entries:
+            self._drop(key)
+            self._remove(self.raw_path_for(key))
+        size = os.path.getsize(path)
+        self.entries[key] = {"key": key, "size": size, **meta}
+        self.total_bytes += size
+        if self.listener:
+            self.listener.added(key, self.entries[key])
+        self._dirty = True
+        self.evict()
+        self.save()
+
+    def add_raw(self, path: str):
+        """Account for the raw PCM copy just written next to the MP3 at path."""
+        key = self.key_of(path)
+        raw_path = self.raw_path_for(key)
+        entry = self.entries.get(key)
+        if entry is None:
+            # Evicted while it was transcoding.
+            self._remove(raw_path)
+            return
+        self.total_bytes -= entry.get("raw_size", 0)
+        entry["raw_size"] = os.path.getsize(raw_path)
+        self.total_bytes += entry["raw_size"]
+        self._dirty = True
+        self.evict()
+        self.save()
+
+    def quarantine(self, path: str):
+        """Stop serving a cached file that failed to play.
+
+        The entry is dropped, so the next fetch downloads the song again.
+        The file and its raw copy are deleted, or, while other queued
+        tracks still pin them, once the last of those is unpinned.
+        """
+        key = self.key_of(path)
+        if key in self.entries:
+            self._drop(key)
+            self.save()
+        if path in self._pins:
+            self._condemned.add(path)
+        else:
+            self._remove(path)
+            self._remove(self.raw_path_for(key))
+        self.quarantined += 1
+
+    def entry_for(self, path: str) -> Optional[Dict[str, Any]]:
+        return self.entries.get(self.key_of(path))
+
+    def annotate(self, path: str, **fields):
+        """Store fields in the index entry of the cached file at path."""
+        entry = self.entry_for(path)
+        if entry is None:
+            return
+        entry.update(fields)
+        self._dirty = True
+        self.save()
+
+    def raw_for(self, path: str) -> Optional[str]:
+        """The raw PCM copy of the cached MP3 at path, if it has one."""
+        key = self.key_of(path)
+        entry = self.entries.get(key)
+        if not entry or "raw_size" not in entry:
+            return None
+        raw_path = self.raw_path_for(key)
+        if not os.path.exists(raw_path):
+            self.total_bytes -= entry.pop("raw_size")
+            self._dirty = True
+            return None
+        return raw_path
+
+    def remember(self, song_id: str, **meta):
+        """Merge meta into a song's metadata, keeping the fields it does not name (thumb_file_id)."""
+        self._store_metadata(song_id, {**self.metadata_for(song_id), **meta})
+
+    def _store_metadata(self, song_id: str, meta: Dict[str, str]):
+        self.metadata[song_id] = meta
+        self.metadata.move_to_end(song_id)
+        while len(self.metadata) > TRACK_METADATA_SIZE:
+            self.metadata.popitem(last=False)
+
+    def update_metadata(self, song_id: str, **fields):
+        """Merge fields into a song's metadata, None removes a field."""
+        meta = dict(self.metadata_for(song_id))
+        meta.update(fields)
+        self._store_metadata(song_id, {field: value for field, value in meta.items() if value is not None})
+        for entry in self.entries.values():
+            if entry.get("song_id") == song_id:
+                for field, value in fields.items():
+                    if value is None:
+                        entry.pop(field, None)
+                    else:
+                        entry[field] = value
+                self._dirty = True
+
+    def metadata_for(self, song_id: str) -> Dict[str, str]:
+        return self.metadata.get(song_id) or {}
+
+    def pin(self, path: str):
+        self._pins[path] = self._pins.get(path, 0) + 1
+
+    def unpin(self, path: str):
+        count = self._pins.get(path, 0) - 1
+        if count > 0:
+            self._pins[path] = count
+            return
+        self._pins.pop(path, None)
+        if path in self._condemned:
+            self._condemned.discard(path)
+            key = self.key_of(path)
+            # Unless the song was downloaded again meanwhile, into the same file.
+            if key not in self.entries and key not in self._pending:
+                self._remove(path)
+                self._remove(self.raw_path_for(key))
+
+    def evict(self):
+        # The newest entry is the one being added, never evict it straight away.
+        for key in list(self.entries)[:-1]:
+            if self.total_bytes <= self.max_bytes:
+                break
+            path = self.path_for(key)
+            if path in self._pins:
+                continue
+            self._remove(path)
+            self._remove(self.raw_path_for(key))
+            self._drop(key)
+            self.evictions += 1
+
+    def _drop(self, key: str):
+        self.total_bytes -= self._bytes(self.entries.pop(key))
+        self._dirty = True
+        if self.listener:
+            self.listener.removed(key)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self.entries),
+            "raw": sum(1 for entry in self.entries.values() if "raw_size" in entry),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "quarantined": self.quarantined,
+        }
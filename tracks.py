@@ -0,0 +1,109 @@
+import sys
+from typing import Any, Dict, Optional
+
+
+def format_duration(seconds: int) -> str:
+    if not seconds:
+        return "Unknown"
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes}:{seconds:02}"
+
+
+def parse_duration(value: Any) -> int:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+class Track:
+    """A queued song, kept small because thousands can be queued at once.
+
+    Repeating strings (ID, title, artist, quality) are interned so a song
+    queued many times, or across chats, stores them once. Album and
+    thumbnail are not stored on the track: they live once per song in
+    `Track.metadata` (the TrackCache, which persists them in its index)
+    and are looked up when a caption is built.
+    """
+
+    __slots__ = ("song_id", "title", "artist", "duration", "quality", "url", "path")
+
+    # Set by the bot to its TrackCache, the source of album/thumbnail.
+    metadata = None
+
+    def __init__(self, song_id: str = "", title: str = "", artist: str = "", duration: int = 0,
+                 quality: str = "", url: str = "", path: str = "", album: str = "", thumbnail: str = ""):
+        self.song_id = sys.intern(song_id)
+        self.title = sys.intern(title)
+        self.artist = sys.intern(artist)
+        self.duration = duration
+        self.quality = sys.intern(quality)
+        self.url = url
+        self.path = path
+        if song_id and (album or thumbnail) and Track.metadata is not None:
+            Track.metadata.remember(song_id, album=sys.intern(album), thumbnail=thumbnail)
+
+    @classmethod
+    def from_song(cls, song: Dict[str, Any], download: Dict[str, str]) -> "Track":
+        """Build a track from a JioSaavn song object and its chosen downloadUrl entry."""
+        album = song.get("album")
+        return cls(
+            song_id=str(song["id"]),
+            title=song.get("name", "Unknown Title"),
+            artist=song.get("primaryArtists", "Unknown Artist"),
+            duration=parse_duration(song.get("duration")),
+            quality=download.get("quality", ""),
+            url=download["link"],
+            album=album.get("name", "Unknown Album") if isinstance(album, dict) else album or "Unknown Album",
+            thumbnail=song.get("image", [])[-1].get("link", "") if song.get("image") else "",
+        )
+
+    @classmethod
+    def from_cache_entry(cls, entry: Dict[str, Any]) -> "Track":
+        """Build a track from a TrackCache index entry, played from the cached file.
+
+        The entry's download link is kept in case the file is evicted
+        before it plays; entries older than that have none.
+        """
+        return cls(
+            song_id=entry["song_id"],
+            title=entry.get("title") or "Unknown Title",
+            artist=entry.get("artist") or "Unknown Artist",
+            duration=entry.get("duration") or 0,
+            quality=entry.get("quality", ""),
+            url=entry.get("url", ""),
+        )
+
+    def _meta(self, field: str) -> Optional[str]:
+        if not self.song_id or Track.metadata is None:
+            return None
+        return Track.metadata.metadata_for(self.song_id).get(field)
+
+    @property
+    def album(self) -> str:
+        return self._meta("album") or "Unknown Album"
+
+    @property
+    def thumbnail(self) -> str:
+        return self._meta("thumbnail") or ""
+
+    @property
+    def duration_text(self) -> str:
+        return format_duration(self.duration)
+
+    def to_state(self) -> Dict[str, Any]:
+        """Plain dict for persisting the track, see from_state."""
+        state = {slot: getattr(self, slot) for slot in self.__slots__ if getattr(self, slot)}
+        if self.song_id:
+            # The cache hands the file back on the next prefetch.
+            state.pop("path", None)
+            state.update(album=self.album, thumbnail=self.thumbnail)
+        return state
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "Track":
+        return cls(**state)
+
+    def __repr__(self) -> str:
+        return f"Track(song_id={self.song_id!r}, title={self.title!r})"
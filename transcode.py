@@ -0,0 +1,92 @@
+import asyncio
+import os
+from typing import Dict, Optional
+
+from ntgcalls import MediaSource
+from pytgcalls.types.raw import AudioParameters, AudioStream, Stream
+
+from config import TRANSCODE_WORKERS, FFMPEG_BINARY
+from track_cache import TrackCache
+
+# What a call consumes, the same as MediaStream's default AudioQuality.HIGH.
+SAMPLE_RATE = 48000
+CHANNELS = 2
+
+
+class Transcoder:
+    """Turns cached MP3s into the raw PCM a call plays, once per track.
+
+    Playing an MP3 makes ffmpeg decode and resample it in real time for
+    every call it is in. A track that has been converted to 48 kHz stereo
+    s16le is instead handed to the call as a raw stream, which is read
+    straight from disk. Conversions run as separate ffmpeg processes, at
+    most `workers` at a time, and the result is stored next to the MP3 in
+    the track cache. With a LoudnessAnalyzer attached the track's gain is
+    measured first and baked into the raw copy.
+    """
+
+    def __init__(self, cache: TrackCache, workers: int = TRANSCODE_WORKERS, ffmpeg: str = FFMPEG_BINARY,
+                 loudness=None):
+        self.cache = cache
+        self.loudness = loudness
+        self.ffmpeg = ffmpeg
+        self.semaphore = asyncio.Semaphore(workers)
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.done = 0
+        self.failed = 0
+
+    def stream(self, path: str) -> Optional[Stream]:
+        """A raw stream of the cached track at path, None if it is not converted yet."""
+        raw_path = self.cache.raw_for(path)
+        if not raw_path or not self._current(path):
+            return None
+        return Stream(microphone=AudioStream(MediaSource.FILE, raw_path, AudioParameters(SAMPLE_RATE, CHANNELS)))
+
+    def _current(self, path: str) -> bool:
+        """Whether the raw copy has the track's current gain in it."""
+        entry = self.cache.entry_for(path) or {}
+        return entry.get("raw_gain_db") == entry.get("gain_db")
+
+    def schedule(self, path: str) -> Optional[asyncio.Task]:
+        """Start converting the cached track at path unless it is done or underway."""
+        if (self.cache.raw_for(path) and self._current(path)) or path in self.tasks:
+            return None
+        task = asyncio.create_task(self._transcode(path))
+        self.tasks[path] = task
+        task.add_done_callback(lambda t: self.tasks.pop(path, None))
+        return task
+
+    async def _transcode(self, path: str):
+        raw_path = self.cache.raw_path_for(self.cache.key_of(path))
+        part_path = f"{raw_path}.part"
+        try:
+            gain = await self.loudness.analyze(path) if self.loudness else None
+            volume = ["-af", f"volume={gain:.2f}dB"] if gain else []
+            async with self.semaphore:
+                process = await asyncio.create_subprocess_exec(
+                    self.ffmpeg, "-nostdin", "-v", "error", "-y", "-i", path, *volume,
+                    "-f", "s16le", "-ac", str(CHANNELS), "-ar", str(SAMPLE_RATE), part_path,
+                    stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+                )
+                try:
+                    _, stderr = await process.communicate()
+                finally:
+                    if process.returncode is None:
+                        process.kill()
+                        await process.wait()
+            if process.returncode != 0:
+                raise RuntimeError(stderr.decode("utf-8", "replace").strip())
+            os.replace(part_path, raw_path)
+        except Exception as e:
+            self.failed += 1
+            print(f"Error transcoding {path}: {str(e)}")
+            return
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        self.cache.add_raw(path)
+        self.cache.annotate(path, raw_gain_db=gain)
+        self.done += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"transcoding": len(self.tasks), "done": self.done, "failed": self.failed}
@@ -0,0 +1,41 @@
+import shlex
+from typing import Optional
+
+from ntgcalls import MediaSource
+from pytgcalls.types.raw import AudioParameters, AudioStream, Stream
+
+from config import FFMPEG_BINARY
+from transcode import SAMPLE_RATE, CHANNELS
+
+
+def _input_chain(index: int, gain: Optional[float]) -> str:
+    chain = f"[{index}:a]aresample={SAMPLE_RATE},aformat=sample_fmts=s16:channel_layouts=stereo"
+    if gain:
+        chain += f",volume={gain:.2f}dB"
+    return f"{chain}[a{index}]"
+
+
+def splice_command(current: str, position: float, following: str, crossfade: float,
+                   gains=(None, None), ffmpeg: str = FFMPEG_BINARY) -> str:
+    """Shell command writing the rest of current, from position seconds on,
+    followed by all of following as raw PCM.
+
+    The two overlap for crossfade seconds, or are joined back to back
+    when it is 0. gains are the loudness gains (dB) of the two files.
+    """
+    if crossfade > 0:
+        join = f"[a0][a1]acrossfade=d={crossfade}[out]"
+    else:
+        join = "[a0][a1]concat=n=2:v=0:a=1[out]"
+    graph = ";".join([_input_chain(0, gains[0]), _input_chain(1, gains[1]), join])
+    return shlex.join([
+        ffmpeg, "-nostdin", "-v", "quiet", "-ss", f"{position:.2f}", "-i", current, "-i", following,
+        "-filter_complex", graph, "-map", "[out]",
+        "-f", "s16le", "-ac", str(CHANNELS), "-ar", str(SAMPLE_RATE), "pipe:1",
+    ])
+
+
+def splice_stream(current: str, position: float, following: str, crossfade: float, gains=(None, None)) -> Stream:
+    """A call stream playing splice_command's output."""
+    command = splice_command(current, position, following, crossfade, gains)
+    return Stream(microphone=AudioStream(MediaSource.SHELL, command, AudioParameters(SAMPLE_RATE, CHANNELS)))
@@ -1,223 +1,763 @@
+from time import time
+
+# Before the slow imports below, see startup_seconds.
+STARTED_AT = time()
+
 from pyrogram import Client, filters, idle
-from pyrogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup
-from pytgcalls import PyTgCalls, idle as pyidle
+from pyrogram.errors import FloodWait, MessageNotModified
+from pyrogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
+from pytgcalls import idle as pyidle, filters as call_filters
 from pytgcalls.types import MediaStream as AudioPiped, Call, StreamEnded as StreamAudioEnded
+from pytgcalls.exceptions import NoActiveGroupCall, CallBusy, CallDeclined, CallDiscarded, NoAudioSourceFound
+from ntgcalls import FileError
 import os
-import requests
-import urllib.parse
-from config import API_ID, API_HASH, BOT_TOKEN, SESSION_NAME
+from config import (
+    API_ID, API_HASH, BOT_TOKEN, DIRECT_STREAMING, QUEUE_PAGE_SIZE, SHELL_TIMEOUT, SHELL_EDIT_INTERVAL,
+    TRANSCODE_RAW, LOUDNESS_NORMALIZATION, TRANSITIONS, CROSSFADE_SECONDS, TRANSITION_MARGIN, METRICS_HOST, METRICS_PORT,
+    PLAY_RETRIES, PLAY_RETRY_DELAY, PLAY_MAX_FAILURES, LIBRARY_SEARCH_RESULTS,
+)
+from saavn import SaavnClient, best_download
+from track_cache import TrackCache
+from library import LibraryIndex
+from tracks import Track
+from thumbnails import Thumbnails
+from sessions import ChatSession, SessionManager
+from prefetch import Prefetcher
+from transcode import Transcoder
+from loudness import LoudnessAnalyzer, volume_filter
+from transitions import splice_stream
+from metrics import Metrics, labels, serve as serve_metrics
+from outbox import Outbox
+from assistants import AssistantPool
+from state_store import SessionStore
 from typing import Optional, List
-from dataclasses import dataclass
 import asyncio
+import codecs
+import html
 import re
-import subprocess
 import sys
 from io import StringIO
-from time import time
-import traceback
-from inspect import getfullargspec
-
-@dataclass
-class Track:
-    path: str
-    title: str = ""
-    thumbnail: str = ""
-    artist: str = ""
-    album: str = ""
-    duration: str = ""
+
+# Failures of the voice chat itself, retrying or skipping tracks cannot help.
+CALL_ERRORS = (NoActiveGroupCall, CallBusy, CallDeclined, CallDiscarded)
+# Failures pointing at the file itself (missing, truncated, not audio).
+FILE_ERRORS = (FileNotFoundError, FileError, NoAudioSourceFound)
 
 class MusicBot:
     def __init__(self):
-        self.userbot = Client("userbot_py", api_id=API_ID, api_hash=API_HASH, session_string=SESSION_NAME)
         self.bot = Client("music_bot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
-        self.pytgcalls = PyTgCalls(self.userbot)
-        self.queue: List[Track] = []
-        self.current_track: Optional[Track] = None
-        self.chat_id: Optional[int] = None
+        # Routes each chat's call to one of the ASSISTANT_SESSIONS userbots.
+        self.pytgcalls = AssistantPool()
+        self.userbot = self.pytgcalls.assistants[0].client
+        self.saavn = SaavnClient()
+        # Read by warm_cache once the bot is up, see start.
+        self.cache = TrackCache(self.saavn.download, load=False)
+        Track.metadata = self.cache
+        self.library = LibraryIndex(self.cache)
+        self.cache_warm = None
+        self.thumbnails = Thumbnails(self.saavn, self.cache)
+        self.loudness = LoudnessAnalyzer(self.cache) if LOUDNESS_NORMALIZATION else None
+        self.transcoder = Transcoder(self.cache, loudness=self.loudness) if TRANSCODE_RAW else None
+        self.prefetcher = Prefetcher(self.cache, transcoder=self.transcoder, loudness=self.loudness)
+        self.store = SessionStore()
+        self.sessions = SessionManager(self.store)
+        self.background_tasks = set()
+        self.transition_tasks = {}
+        self.metrics = Metrics()
+        self.metrics_runner = None
+        self.startup_seconds = None
+        self.outbox = Outbox(self.bot, self.metrics)
+        self.register_metrics()
+        self.shell_jobs = {}
         self.OWNER_ID = 5896960462
         self.LOG_CHAT_ID = -1002519094633
 
-    @staticmethod
-    def ensure_downloads_dir():
-        os.makedirs("downloads", exist_ok=True)
-
-    async def is_in_vc(self) -> bool:
+    async def is_in_vc(self, chat_id: int) -> bool:
         try:
-            return self.chat_id in self.pytgcalls.calls
+            return chat_id in await self.pytgcalls.calls
         except Exception:
             return False
 
+    async def fetch_song(self, query: str) -> Optional[Track]:
+        with self.metrics.timer("fetch_song_seconds"):
+            entry = self.library.match(query)
+            if entry:
+                # Already downloaded, no need to ask JioSaavn.
+                return Track.from_cache_entry(entry)
+            try:
+                results = await self.saavn.search_songs(query)
+                if not results:
+                    return None
+                song = results[0]
+                download = best_download(song)
+                if not download:
+                    return None
+                return Track.from_song(song, download)
+            except Exception:
+                self.metrics.inc("fetch_song_errors_total")
+                return None
+
+    async def start_stream(self, session: ChatSession, track: Track):
+        """Start track in the chat's call.
+
+        A track that is not downloaded yet is streamed from its URL while
+        the cache fills in parallel, falling back to the full download if
+        the stream cannot be opened. A cached track already converted by
+        the Transcoder is played from its raw PCM copy, others get their
+        measured loudness gain applied as a volume filter.
+        """
+        started = time()
+        if not track.path and DIRECT_STREAMING and track.url:
+            self.prefetcher.prefetch(track)
+            try:
+                await self.pytgcalls.play(session.chat_id, AudioPiped(track.url))
+                session.time_to_audio = time() - started
+                self.metrics.observe("time_to_audio_seconds", session.time_to_audio, source="url")
+                return
+            except CALL_ERRORS:
+                raise
+            except Exception as e:
+                print(f"Direct stream of {track.title} failed, waiting for download: {str(e)}")
+        path = await self.prefetcher.ensure(track)
+        stream = self.transcoder.stream(path) if self.transcoder and track.song_id else None
+        if stream is None:
+            gain = self.loudness.gain_for(path) if self.loudness and track.song_id else None
+            stream = AudioPiped(path, ffmpeg_parameters=volume_filter(gain))
+        await self.pytgcalls.play(session.chat_id, stream)
+        session.time_to_audio = time() - started
+        self.metrics.observe("time_to_audio_seconds", session.time_to_audio, source="file")
+
+    async def play_next(self, session: ChatSession):
+        async with session.lock:
+            with self.metrics.timer("play_next_seconds"):
+                await self._play_next(session)
+
+    async def _play_next(self, session: ChatSession, requested_at: Optional[float] = None, joined: bool = False):
+        """Start the next track of the queue that plays.
+
+        Each track gets play_track's retries; a track that still fails is
+        skipped, and after PLAY_MAX_FAILURES in a row playback stops and
+        the bot leaves the call. Errors from the call itself (no voice
+        chat, call discarded) stop at once and leave the track queued.
+        """
+        if session.current_track:
+            self.prefetcher.release(session.current_track)
+        failures = 0
+        while session.queue:
+            session.current_track = session.queue.popleft()
+            self.prefetcher.schedule(session)
+            try:
+                started = await self.play_track(session, session.current_track)
+            except CALL_ERRORS as e:
+                self.metrics.inc("play_errors_total")
+                self.prefetcher.release(session.current_track)
+                session.queue.appendleft(session.current_track)
+                session.current_track = None
+                self.outbox.status(session.chat_id, "error", f"❌ Error joining voice chat: {str(e)}")
+                return
+            if started:
+                if requested_at:
+                    self.metrics.observe("play_to_audio_seconds", time() - requested_at)
+                session.record_gap(time())
+                self.watch_transition(session)
+                caption = self.now_playing(session.current_track)
+                if joined:
+                    caption = f"🎙️ Joined voice chat and started playback!\n{caption}"
+                self.send_card(session.chat_id, session.current_track, caption, key="now_playing")
+                return
+            self.metrics.inc("play_errors_total")
+            self.prefetcher.release(session.current_track)
+            failures += 1
+            if failures >= PLAY_MAX_FAILURES:
+                session.current_track = None
+                self.outbox.status(session.chat_id, "error", f"❌ {failures} tracks in a row failed to play, playback stopped.")
+                try:
+                    await self.pytgcalls.leave_call(session.chat_id)
+                except Exception as e:
+                    print(f"Error leaving call in {session.chat_id}: {str(e)}")
+                return
+        session.current_track = None
+        self.outbox.status(session.chat_id, "playback", "🎶 Queue is empty, playback stopped.")
+
+    async def play_track(self, session: ChatSession, track: Track) -> bool:
+        """Start track, retrying with exponential backoff, False if it never started.
+
+        When the cached file itself is at fault (FILE_ERRORS) it is
+        quarantined before the retry and, when the song has other
+        downloadUrl entries, the next best quality is tried instead. Other
+        errors are retried with the same file.
+
+        A track taken from the library without a download link, whose file
+        has been evicted since, gets a fresh link first.
+        """
+        if track.song_id and not track.url and not track.path and not self.cache.lookup(track.song_id, track.quality):
+            await self.switch_quality(track, set())
+        tried = {track.quality}
+        delay = PLAY_RETRY_DELAY
+        for attempt in range(PLAY_RETRIES + 1):
+            try:
+                await self.start_stream(session, track)
+                return True
+            except CALL_ERRORS:
+                raise
+            except Exception as e:
+                error = e
+            if attempt == PLAY_RETRIES:
+                break
+            self.metrics.inc("play_retries_total")
+            print(f"Error playing {track.title}, retrying in {delay}s: {str(error)}")
+            if not track.path or isinstance(error, FILE_ERRORS):
+                if track.path and track.song_id:
+                    path = track.path
+                    self.prefetcher.release(track)
+                    track.path = ""
+                    self.cache.quarantine(path)
+                await self.switch_quality(track, tried)
+            await asyncio.sleep(delay)
+            delay *= 2
+        self.outbox.status(session.chat_id, "error", f"❌ Error playing {track.title}, skipped: {str(error)}")
+        return False
+
+    async def switch_quality(self, track: Track, tried: set):
+        """Point track at the best downloadUrl entry whose quality is not in tried."""
+        if not track.song_id:
+            return
+        try:
+            song = await self.saavn.get_song(track.song_id)
+        except Exception as e:
+            print(f"Error fetching download links of {track.title}: {str(e)}")
+            return
+        for download in reversed((song or {}).get("downloadUrl") or []):
+            if download.get("link") and download.get("quality") not in tried:
+                tried.add(download["quality"])
+                track.quality = download["quality"]
+                track.url = download["link"]
+                return
+
     @staticmethod
-    async def fetch_song(query: str) -> Optional[Track]:
+    def now_playing(track: Track) -> str:
+        return f"🎵 Now playing: {track.title}\n👤 Artist: {track.artist}\n📀 Album: {track.album}\n⏳ Duration: {track.duration_text}"
+
+    def watch_transition(self, session: ChatSession):
+        """Start splicing each next track onto the current one of the chat, unless already running."""
+        task = self.transition_tasks.get(session.chat_id)
+        if not TRANSITIONS or (task and not task.done()):
+            return
+        self.transition_tasks[session.chat_id] = asyncio.create_task(self.run_transitions(session))
+
+    async def run_transitions(self, session: ChatSession):
+        """Switch to the next track shortly before the current one ends.
+
+        The call gets one stream holding the rest of the current track
+        crossfaded (or joined) into the whole next one, so there is no
+        stop and restart between them. Only done when both are downloaded,
+        otherwise the stream end starts the next track as before.
+        """
+        lead = CROSSFADE_SECONDS + TRANSITION_MARGIN
+        spliced, offset = None, 0
         try:
-            url = f"https://jiosaavn-api-privatecvc2.vercel.app/search/songs?query={urllib.parse.quote(query)}"
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            if data.get("status") != "SUCCESS" or not data.get("data", {}).get("results"):
+            while True:
+                track = session.current_track
+                if not track or not track.duration:
+                    return
+                try:
+                    played = await self.pytgcalls.time(session.chat_id)
+                except Exception:
+                    return
+                # After a splice the stream started with the tail of the previous track.
+                position = played - offset if track is spliced else played
+                remaining = track.duration - position
+                if remaining > lead:
+                    await asyncio.sleep(min(remaining - lead, 5))
+                    continue
+                tail = await self.splice_next(session, track, position)
+                if tail is None:
+                    return
+                spliced, offset = session.current_track, tail
+        finally:
+            if self.transition_tasks.get(session.chat_id) is asyncio.current_task():
+                del self.transition_tasks[session.chat_id]
+
+    async def splice_next(self, session: ChatSession, track: Track, position: float) -> Optional[float]:
+        """Splice the next queued track onto track at position, returns the seconds of track left before it."""
+        async with session.lock:
+            if session.current_track is not track or not session.queue:
                 return None
-            song = data["data"]["results"][0]
-            title = song.get("name", "Unknown Title")
-            download_url = song.get("downloadUrl", [])[-1].get("link")
-            thumbnail = song.get("image", [])[-1].get("link") if song.get("image") else ""
-            artist = song.get("primaryArtists", "Unknown Artist")
-            album = song.get("album", {}).get("name", "Unknown Album")
-            duration = song.get("duration", "Unknown")
-            if not download_url:
+            following = session.queue[0]
+            if not track.path or not following.path:
                 return None
-            file_path = f"downloads/{title.replace('/', '_')}.mp3"
-            with open(file_path, "wb") as f:
-                audio_response = requests.get(download_url, timeout=10)
-                audio_response.raise_for_status()
-                f.write(audio_response.content)
-            return Track(path=file_path, title=title, thumbnail=thumbnail, artist=artist, album=album, duration=duration)
-        except Exception:
-            return None
+            tail = max(track.duration - position, 0)
+            crossfade = min(CROSSFADE_SECONDS, tail, following.duration or CROSSFADE_SECONDS)
+            gains = [self.loudness.gain_for(t.path) if self.loudness else None for t in (track, following)]
+            try:
+                await self.pytgcalls.play(session.chat_id, splice_stream(track.path, position, following.path, crossfade, gains))
+            except Exception as e:
+                print(f"Error splicing {following.title} onto {track.title}: {str(e)}")
+                return None
+            self.prefetcher.release(track)
+            session.current_track = session.queue.popleft()
+            session.gaps.append(0.0)
+            self.prefetcher.schedule(session)
+        self.send_card(session.chat_id, session.current_track, self.now_playing(session.current_track), key="now_playing")
+        return tail - crossfade
 
-    async def play_next(self):
-        if not self.queue:
-            self.current_track = None
-            await self.bot.send_message(self.chat_id, "🎶 Queue is empty, playback stopped.")
-            return
-        self.current_track = self.queue.pop(0)
+    def send_card(self, chat_id: int, track: Track, caption: str, reply_to_message_id: Optional[int] = None,
+                  key: Optional[str] = None) -> asyncio.Future:
+        """Queue caption with the track's cover in the outbox, see deliver_card."""
+        return self.outbox.submit(chat_id, lambda: self.deliver_card(chat_id, track, caption, reply_to_message_id), key)
+
+    async def deliver_card(self, chat_id: int, track: Track, caption: str, reply_to_message_id: Optional[int] = None):
+        """Send caption with the track's cover, reusing its cached file_id when there is one."""
         try:
-            await self.pytgcalls.play(self.chat_id, AudioPiped(self.current_track.path))
-            caption = f"🎵 Now playing: {self.current_track.title}\n👤 Artist: {self.current_track.artist}\n📀 Album: {self.current_track.album}\n⏳ Duration: {self.current_track.duration}"
-            if self.current_track.thumbnail:
-                await self.bot.send_photo(self.chat_id, self.current_track.thumbnail, caption=caption)
-            else:
-                await self.bot.send_message(self.chat_id, caption)
+            photo = await self.thumbnails.photo(track)
         except Exception as e:
-            await self.bot.send_message(self.chat_id, f"❌ Error playing track: {str(e)}")
-            await self.play_next()
+            print(f"Error preparing cover for {track.title}: {str(e)}")
+            photo = None
+        if photo is not None:
+            try:
+                with self.metrics.timer("telegram_send_seconds", method="send_photo"):
+                    sent = await self.bot.send_photo(chat_id, photo, caption=caption, reply_to_message_id=reply_to_message_id)
+                self.thumbnails.remember(track, sent)
+                return sent
+            except FloodWait:
+                raise
+            except Exception as e:
+                self.metrics.inc("telegram_send_errors_total", method="send_photo")
+                if isinstance(photo, str):
+                    self.thumbnails.forget(track)
+                print(f"Error sending cover for {track.title}: {str(e)}")
+        return await self.send_message(chat_id, caption, reply_to_message_id=reply_to_message_id)
+
+    def reply(self, message: Message, text: str, **kwargs) -> asyncio.Future:
+        """Queue a reply to message in the outbox."""
+        return self.outbox.submit(message.chat.id, lambda: message.reply(text, **kwargs))
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        try:
+            with self.metrics.timer("telegram_send_seconds", method="send_message"):
+                return await self.bot.send_message(chat_id, text, **kwargs)
+        except Exception:
+            self.metrics.inc("telegram_send_errors_total", method="send_message")
+            raise
 
     async def on_stream_end(self, client: Client, update: StreamAudioEnded):
-        if isinstance(update, StreamAudioEnded) and update.chat_id == self.chat_id:
-            await self.play_next()
+        if isinstance(update, StreamAudioEnded):
+            self.metrics.inc("stream_ends_total")
+            session = self.sessions.find(update.chat_id)
+            if session:
+                session.stream_ended_at = time()
+                with self.metrics.timer("stream_end_seconds"):
+                    await self.play_next(session)
 
     async def start_command(self, _, message):
-        await message.reply("🎉 Music Bot started! Use /play, /join, /skip, /pause, /resume, /stop, /queue, /ping, /e, or /sh.")
+        self.reply(message, "🎉 Music Bot started! Use /play, /search, /playlist, /album, /join, /skip, /pause, /resume, /stop, /queue, /remove, /move, /shuffle, /clear, /ping, /stats, /e, or /sh.")
+
+    def register_metrics(self):
+        m = self.metrics
+        m.describe("fetch_song_seconds", "Search and metadata lookup for /play")
+        m.describe("play_next_seconds", "Track change, from taking the next track to its card being sent")
+        m.describe("stream_end_seconds", "Handling of a stream end, including the lock wait")
+        m.describe("play_to_audio_seconds", "From a /play arriving in an idle chat to its track playing")
+        m.describe("time_to_audio_seconds", "From starting a track to its stream playing, by source")
+        m.describe("telegram_send_seconds", "Bot API message sends, by method")
+        m.describe("cache_warm_seconds", "Reading the track cache index and indexing the library at startup")
+        m.gauge("startup_seconds", lambda: self.startup_seconds or 0, "From process start to the bot taking commands")
+        m.gauge("chats", lambda: len(self.sessions), "Chats with a session")
+        m.gauge("assistant_calls", lambda: {
+            labels(assistant=index): load for index, load in enumerate(self.pytgcalls.stats())
+        }, "Voice chats held by each assistant account")
+        m.gauge("queue_length", lambda: {labels(chat_id=s.chat_id): len(s.queue) for s in self.sessions}, "Queued tracks per chat")
+        m.gauge("track_gap_milliseconds", lambda: {
+            labels(chat_id=s.chat_id): s.average_gap for s in self.sessions if s.average_gap is not None
+        }, "Average silence between tracks per chat")
+        m.gauge("track_cache_hits_total", lambda: self.cache.hits, kind="counter")
+        m.gauge("track_cache_misses_total", lambda: self.cache.misses, kind="counter")
+        m.gauge("track_cache_evictions_total", lambda: self.cache.evictions, kind="counter")
+        m.gauge("track_cache_bytes", lambda: self.cache.total_bytes, "Disk used by cached tracks")
+        m.gauge("search_cache_hits_total", lambda: self.saavn.search_cache.hits, kind="counter")
+        m.gauge("search_cache_misses_total", lambda: self.saavn.search_cache.misses, kind="counter")
+        m.gauge("downloads_total", lambda: self.saavn.downloads, kind="counter")
+        m.gauge("downloaded_bytes_total", lambda: self.saavn.downloaded_bytes, kind="counter")
+        m.gauge("download_seconds_total", lambda: self.saavn.download_seconds, kind="counter")
+        m.gauge("library_entries", lambda: self.library.stats()["entries"], "Downloaded songs in the search index")
+        m.gauge("library_hits_total", lambda: self.library.hits, kind="counter")
+        m.gauge("track_cache_quarantined_total", lambda: self.cache.quarantined, kind="counter")
+        m.describe("outbox_delivery_seconds", "Outgoing message deliveries, by send, status post or status edit")
+        m.gauge("outbox_queued", lambda: self.outbox.stats()["queued"], "Messages waiting in the outbox")
+        m.gauge("outbox_coalesced_total", lambda: self.outbox.coalesced, kind="counter")
+        m.gauge("outbox_flood_waits_total", lambda: self.outbox.flood_waits, kind="counter")
+        m.gauge("prefetch_pending", lambda: self.prefetcher.stats()["pending"], "Queued tracks waiting for or downloading")
+
+    @staticmethod
+    def hit_rate(hits: int, misses: int) -> str:
+        return f"{hits * 100 / (hits + misses):.0f}%" if hits + misses else "n/a"
+
+    async def stats_command(self, _, message):
+        m = self.metrics
+        lines = ["📊 Bot stats"]
+        for name, label in (
+            ("fetch_song_seconds", "🔎 Search"),
+            ("play_to_audio_seconds", "▶ /play to audio"),
+            ("time_to_audio_seconds", "🎧 Time to audio"),
+            ("play_next_seconds", "⏭ Track change"),
+            ("stream_end_seconds", "🔚 Stream end"),
+            ("telegram_send_seconds", "📤 Telegram sends"),
+            ("outbox_delivery_seconds", "📬 Outbox deliveries"),
+        ):
+            timing = m.timing(name)
+            if timing:
+                count, average, worst = timing
+                lines.append(f"{label}: {count}x, avg {average * 1000:.0f}ms, max {worst * 1000:.0f}ms")
+        lines.append(f"💾 Track cache: {self.hit_rate(self.cache.hits, self.cache.misses)} hits, "
+                     f"{len(self.cache.entries)} tracks, {self.cache.total_bytes / 2 ** 20:.0f} MB")
+        library = self.library.stats()
+        lines.append(f"📚 Library: {library['entries']} songs, {library['hits']} /play requests served offline")
+        lines.append(f"🔍 Search cache: {self.hit_rate(self.saavn.search_cache.hits, self.saavn.search_cache.misses)} hits")
+        if self.saavn.download_seconds:
+            lines.append(f"⬇️ Downloads: {self.saavn.downloads}, {self.saavn.downloaded_bytes / 2 ** 20:.0f} MB "
+                         f"at {self.saavn.downloaded_bytes / 2 ** 20 / self.saavn.download_seconds:.1f} MB/s")
+        queued = sum(len(session.queue) for session in self.sessions)
+        lines.append(f"🎶 Chats: {len(self.sessions)}, {queued} tracks queued")
+        outbox = self.outbox.stats()
+        lines.append(f"📬 Outbox: {outbox['queued']} queued, {outbox['coalesced']} merged, {outbox['flood_waits']} flood waits")
+        if self.startup_seconds is not None:
+            warm = m.timing("cache_warm_seconds")
+            lines.append(f"🚀 Startup: {self.startup_seconds:.2f}s"
+                         + (f", cache ready in {warm[2]:.2f}s" if warm else ""))
+        lines.append(f"⏱ Loop lag: {m.loop_lag * 1000:.0f}ms (max {m.loop_lag_max * 1000:.0f}ms)")
+        errors = m.count("play_errors_total") + m.count("telegram_send_errors_total") + m.count("fetch_song_errors_total")
+        if errors:
+            lines.append(f"❗ Errors: {errors:.0f}")
+        self.reply(message, "\n".join(lines))
 
     async def ping_command(self, _, message):
         try:
-            latency = self.pytgcalls.ping()
-            await message.reply(f"🏓 Pong! Bot is online. Latency: {latency}ms")
+            latency = self.pytgcalls.ping
+            text = f"🏓 Pong! Bot is online. Latency: {latency}ms\n🎧 Active chats: {len(self.sessions)}"
+            if len(self.pytgcalls.assistants) > 1:
+                text += f"\n🤖 Assistants: {len(self.pytgcalls.assistants)}, calls each: {', '.join(map(str, self.pytgcalls.stats()))}"
+            session = self.sessions.find(message.chat.id)
+            if session and session.average_gap is not None:
+                text += f"\n⏱ Gap between tracks: {session.average_gap:.0f}ms (last {session.gaps[-1]:.0f}ms)"
+            self.reply(message, text)
         except Exception as e:
-            await message.reply(f"❌ Error checking ping: {str(e)}")
+            self.reply(message, f"❌ Error checking ping: {str(e)}")
 
     async def join_vc(self, _, message):
-        self.chat_id = message.chat.id
+        session = self.sessions.get(message.chat.id)
         save_mp3_path = os.path.join(os.getcwd(), "Maybe.mp3")
         if not os.path.exists(save_mp3_path):
-            await message.reply("❌ Error: Maybe.mp3 not found!")
+            self.reply(message, "❌ Error: Maybe.mp3 not found!")
             return
-        track = Track(path=save_mp3_path, title="Maybe.mp3", artist="Unknown", album="Unknown", duration="Unknown")
-        if await self.is_in_vc():
-            self.queue.append(track)
-            await message.reply("🎶 Added Maybe.mp3 to queue!")
-            if not self.current_track:
-                await self.play_next()
+        track = Track(path=save_mp3_path, title="Maybe.mp3", artist="Unknown")
+        if await self.is_in_vc(session.chat_id):
+            session.queue.append(track)
+            self.reply(message, "🎶 Added Maybe.mp3 to queue!")
+            if not session.current_track:
+                await self.play_next(session)
             return
         try:
-            await self.pytgcalls.play(self.chat_id, AudioPiped(save_mp3_path))
-            await message.reply("🎙️ Joined voice chat and started playing Maybe.mp3!")
-            self.current_track = track
+            async with session.lock:
+                await self.pytgcalls.play(session.chat_id, AudioPiped(save_mp3_path))
+                session.current_track = track
+            self.reply(message, "🎙️ Joined voice chat and started playing Maybe.mp3!")
         except Exception as e:
-            await message.reply(f"❌ Error joining voice chat: {str(e)}")
+            self.reply(message, f"❌ Error joining voice chat: {str(e)}")
 
     async def play_song(self, _, message):
-        self.chat_id = message.chat.id
+        requested_at = time()
+        session = self.sessions.get(message.chat.id)
         query = " ".join(message.command[1:]) or (message.reply_to_message.text if message.reply_to_message else None)
         if not query:
-            await message.reply("❓ Please provide a song name!")
+            self.reply(message, "❓ Please provide a song name!")
             return
         track = await self.fetch_song(query)
         if not track:
-            await message.reply("❌ No results found or error fetching song!")
+            self.reply(message, "❌ No results found or error fetching song!")
+            return
+        await self.enqueue_track(session, track, message.id, requested_at)
+
+    async def enqueue_track(self, session: ChatSession, track: Track, reply_to_message_id: int,
+                            requested_at: Optional[float] = None):
+        session.queue.append(track)
+        self.prefetcher.schedule(session)
+        caption = f"✅ Added to queue: {track.title}\n👤 Artist: {track.artist}\n📀 Album: {track.album}\n⏳ Duration: {track.duration_text}"
+        self.send_card(session.chat_id, track, caption, reply_to_message_id=reply_to_message_id)
+        if await self.join_and_play(session, requested_at):
+            return
+        if session.current_track:
+            self.outbox.status(session.chat_id, "queued", f"⏳ Queued {len(session.queue)} tracks, will play after: {session.current_track.title}")
+
+    async def search_command(self, _, message):
+        query = " ".join(message.command[1:])
+        if not query:
+            self.reply(message, "❓ Please provide a song name!")
+            return
+        results = self.library.search(query, LIBRARY_SEARCH_RESULTS)
+        if not results:
+            self.reply(message, "❌ No downloaded songs match, use /play to search JioSaavn!")
+            return
+        buttons = [
+            [InlineKeyboardButton(text=f"🎵 {entry['title']} - {entry.get('artist') or 'Unknown Artist'}"[:64],
+                                  callback_data=f"lib {entry['key']}")]
+            for _, entry in results
+        ]
+        self.reply(message, f"🔎 Downloaded songs matching: {query}", reply_markup=InlineKeyboardMarkup(buttons))
+
+    async def library_callback(self, _, query: CallbackQuery):
+        entry = self.cache.entries.get(query.data.split(maxsplit=1)[1])
+        if not entry or not entry.get("song_id"):
+            await query.answer("❌ This song is no longer downloaded!")
+            return
+        session = self.sessions.get(query.message.chat.id)
+        await query.answer(f"🎶 Adding {entry.get('title', 'song')}")
+        await self.enqueue_track(session, Track.from_cache_entry(entry), query.message.id, time())
+
+    async def join_and_play(self, session: ChatSession, requested_at: Optional[float] = None) -> bool:
+        """Start the queue if nothing is playing, joining the call if needed, True if it tried.
+
+        The bot may still be in the call after the queue ran out, it then
+        starts the next track in place.
+
+        requested_at is when the /play that queued the track arrived.
+        """
+        async with session.lock:
+            if session.current_track or not session.queue:
+                return False
+            joined = not await self.is_in_vc(session.chat_id)
+            await self._play_next(session, requested_at, joined=joined)
+            return True
+
+    async def playlist_command(self, _, message):
+        await self.enqueue_collection(message, "playlist")
+
+    async def album_command(self, _, message):
+        await self.enqueue_collection(message, "album")
+
+    async def enqueue_collection(self, message, kind: str):
+        """Queue every song of a JioSaavn playlist or album from one API request."""
+        session = self.sessions.get(message.chat.id)
+        if len(message.command) < 2:
+            self.reply(message, f"❓ Usage: /{kind} <JioSaavn {kind} ID or link>")
             return
-        self.queue.append(track)
-        caption = f"✅ Added to queue: {track.title}\n👤 Artist: {track.artist}\n📀 Album: {track.album}\n⏳ Duration: {track.duration}"
         try:
-            if track.thumbnail:
-                await message.reply_photo(track.thumbnail, caption=caption)
-            else:
-                await message.reply(caption)
+            collection = await self.saavn.get_collection(kind, message.command[1])
         except Exception as e:
-            await message.reply(f"❌ Error sending message: {str(e)}")
-        if not self.current_track and not await self.is_in_vc():
+            self.reply(message, f"❌ Error fetching {kind}: {str(e)}")
+            return
+        tracks, skipped = [], 0
+        for song in (collection or {}).get("songs") or []:
             try:
-                await self.pytgcalls.play(self.chat_id, AudioPiped(self.queue[0].path))
-                caption = f"🎙️ Joined voice chat and started playback!\n🎵 Now playing: {self.queue[0].title}\n👤 Artist: {self.queue[0].artist}\n📀 Album: {self.queue[0].album}\n⏳ Duration: {self.queue[0].duration}"
-                if self.queue[0].thumbnail:
-                    await self.bot.send_photo(self.chat_id, self.queue[0].thumbnail, caption=caption)
-                else:
-                    await self.bot.send_message(self.chat_id, caption)
-                self.current_track = self.queue.pop(0)
+                download = best_download(song)
+                if download:
+                    tracks.append(Track.from_song(song, download))
+                    continue
             except Exception as e:
-                await self.bot.send_message(self.chat_id, f"❌ Error joining voice chat: {str(e)}")
-        elif self.current_track:
-            await message.reply(f"⏳ Queued, will play after: {self.current_track.title}")
+                print(f"Skipping malformed {kind} entry: {str(e)}")
+            skipped += 1
+        if not tracks:
+            self.reply(message, f"❌ No playable songs found in this {kind}!")
+            return
+        name = collection.get("name") or collection.get("title") or kind.title()
+        session.queue.extend(tracks)
+        key = f"{kind} {message.id}"
+        header = f"📀 Queued {len(tracks)} tracks from {name}"
+        if skipped:
+            header += f"\n⚠️ Skipped {skipped} unplayable songs"
+        # Downloaded tracks stay pinned until played, so only the next few
+        # are fetched now and the rest as the queue reaches them, keeping
+        # a long playlist within the cache's disk budget.
+        upcoming = {id(track) for track in session.queue.peek(self.prefetcher.depth)}
+        ahead = [track for track in tracks if id(track) in upcoming]
+        if len(ahead) < len(tracks):
+            header += f"\n⏬ The other {len(tracks) - len(ahead)} download as the queue reaches them"
+        self.outbox.status(message.chat.id, key, f"{header}\n⬇️ Downloading: 0/{len(ahead)}")
+        downloads = [task for task in (self.prefetcher.prefetch(track) for track in ahead) if task]
+        await self.join_and_play(session)
+        task = asyncio.create_task(self.report_downloads(message.chat.id, key, header, len(ahead), downloads))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def report_downloads(self, chat_id: int, key: str, header: str, total: int, downloads: list):
+        """Update one status message, header then progress, as a batch of downloads completes.
+
+        Updates go through the outbox, which merges them into edits of the
+        message posted under key at the chat's message rate.
+        """
+        ready, failed = total - len(downloads), 0
+        for download in asyncio.as_completed(downloads):
+            try:
+                await download
+                ready += 1
+            except (Exception, asyncio.CancelledError):
+                failed += 1
+            self.outbox.status(chat_id, key, f"{header}\n⬇️ Downloading: {ready}/{total}")
+        text = f"{header}\n✅ {ready}/{total} tracks ready"
+        if failed:
+            text += f", {failed} skipped or failed"
+        self.outbox.status(chat_id, key, text)
 
     async def skip_song(self, _, message):
-        self.chat_id = message.chat.id
-        if not self.current_track or not await self.is_in_vc():
-            await message.reply("❌ No song is playing or bot is not in voice chat!")
+        session = self.sessions.get(message.chat.id)
+        if not session.current_track or not await self.is_in_vc(session.chat_id):
+            self.reply(message, "❌ No song is playing or bot is not in voice chat!")
             return
         try:
-            await self.pytgcalls.play(self.chat_id, None)
-            await message.reply(f"⏭ Skipped: {self.current_track.title}")
-            await self.play_next()
+            await self.pytgcalls.play(session.chat_id, None)
+            self.reply(message, f"⏭ Skipped: {session.current_track.title}")
+            await self.play_next(session)
         except Exception as e:
-            await message.reply(f"❌ Error skipping song: {str(e)}")
+            self.reply(message, f"❌ Error skipping song: {str(e)}")
 
     async def pause_song(self, _, message):
-        self.chat_id = message.chat.id
-        if not self.current_track or not await self.is_in_vc():
-            await message.reply("❌ No song is playing or bot is not in voice chat!")
+        session = self.sessions.get(message.chat.id)
+        if not session.current_track or not await self.is_in_vc(session.chat_id):
+            self.reply(message, "❌ No song is playing or bot is not in voice chat!")
             return
         try:
-            await self.pytgcalls.pause(self.chat_id)
-            await message.reply(f"⏸ Paused: {self.current_track.title}")
+            await self.pytgcalls.pause(session.chat_id)
+            self.reply(message, f"⏸ Paused: {session.current_track.title}")
         except Exception as e:
-            await message.reply(f"❌ Error pausing song: {str(e)}")
+            self.reply(message, f"❌ Error pausing song: {str(e)}")
 
     async def resume_song(self, _, message):
-        self.chat_id = message.chat.id
-        if not self.current_track or not await self.is_in_vc():
-            await message.reply("❌ No song is playing or bot is not in voice chat!")
+        session = self.sessions.get(message.chat.id)
+        if not session.current_track or not await self.is_in_vc(session.chat_id):
+            self.reply(message, "❌ No song is playing or bot is not in voice chat!")
             return
         try:
-            call = self.pytgcalls.calls.get(self.chat_id)
-            if call and call.capture == "PAUSED":
-                await self.pytgcalls.resume(self.chat_id)
-                await message.reply(f"▶ Resumed: {self.current_track.title}")
+            call = (await self.pytgcalls.calls).get(session.chat_id)
+            if call and call.capture == Call.Status.PAUSED:
+                await self.pytgcalls.resume(session.chat_id)
+                self.reply(message, f"▶ Resumed: {session.current_track.title}")
             else:
-                await message.reply("❌ Song is not paused!")
+                self.reply(message, "❌ Song is not paused!")
         except Exception as e:
-            await message.reply(f"❌ Error resuming song: {str(e)}")
+            self.reply(message, f"❌ Error resuming song: {str(e)}")
+
+    def render_queue(self, session: ChatSession, page: int):
+        pages = max(1, -(-len(session.queue) // QUEUE_PAGE_SIZE))
+        page = min(max(page, 1), pages)
+        start = (page - 1) * QUEUE_PAGE_SIZE
+        lines = [f"🎵 Current Queue ({len(session.queue)} tracks, page {page}/{pages}):"]
+        if session.current_track:
+            lines.append(f"▶ Now Playing: {session.current_track.title} (Artist: {session.current_track.artist})")
+        for i, track in enumerate(session.queue.page(start, QUEUE_PAGE_SIZE), start + 1):
+            lines.append(f"{i}. {track.title} (Artist: {track.artist})")
+        buttons = []
+        if page > 1:
+            buttons.append(InlineKeyboardButton(text="◀ Prev", callback_data=f"queue {page - 1}"))
+        if page < pages:
+            buttons.append(InlineKeyboardButton(text="Next ▶", callback_data=f"queue {page + 1}"))
+        return "\n".join(lines)[:4096], InlineKeyboardMarkup([buttons]) if buttons else None
 
     async def queue_command(self, _, message):
-        if not self.queue and not self.current_track:
-            await message.reply("🎶 Queue is empty!")
+        session = self.sessions.find(message.chat.id)
+        if not session or session.idle:
+            self.reply(message, "🎶 Queue is empty!")
+            return
+        page = int(message.command[1]) if len(message.command) > 1 and message.command[1].isdigit() else 1
+        text, reply_markup = self.render_queue(session, page)
+        self.reply(message, text, reply_markup=reply_markup)
+
+    async def queue_page_callback(self, _, query: CallbackQuery):
+        session = self.sessions.find(query.message.chat.id)
+        if not session or session.idle:
+            await query.answer("🎶 Queue is empty!")
+            return
+        text, reply_markup = self.render_queue(session, int(query.data.split()[1]))
+
+        async def edit():
+            try:
+                return await query.message.edit_text(text, reply_markup=reply_markup)
+            except MessageNotModified:
+                return None
+
+        # Keyed by message, so quick page flips only send the last page.
+        self.outbox.submit(query.message.chat.id, edit, key=f"queue page {query.message.id}")
+        await query.answer()
+
+    @staticmethod
+    def parse_positions(message, count: int, queue_length: int) -> Optional[List[int]]:
+        """1-based queue positions from the command arguments, as 0-based indexes."""
+        args = message.command[1:1 + count]
+        if len(args) != count or not all(arg.isdigit() for arg in args):
+            return None
+        positions = [int(arg) - 1 for arg in args]
+        if not all(0 <= position < queue_length for position in positions):
+            return None
+        return positions
+
+    async def remove_command(self, _, message):
+        session = self.sessions.find(message.chat.id)
+        positions = self.parse_positions(message, 1, len(session.queue) if session else 0)
+        if not positions:
+            self.reply(message, "❓ Usage: /remove <position in /queue>")
+            return
+        track = session.queue.remove(positions[0])
+        self.prefetcher.release(track)
+        self.prefetcher.schedule(session)
+        self.reply(message, f"🗑 Removed: {track.title}")
+
+    async def move_command(self, _, message):
+        session = self.sessions.find(message.chat.id)
+        positions = self.parse_positions(message, 2, len(session.queue) if session else 0)
+        if not positions:
+            self.reply(message, "❓ Usage: /move <from> <to>")
             return
-        queue_text = "🎵 Current Queue:\n"
-        if self.current_track:
-            queue_text += f"▶ Now Playing: {self.current_track.title} (Artist: {self.current_track.artist})\n"
-        for i, track in enumerate(self.queue, 1):
-            queue_text += f"{i}. {track.title} (Artist: {track.artist})\n"
-        await message.reply(queue_text)
+        track = session.queue[positions[0]]
+        session.queue.move(*positions)
+        self.prefetcher.schedule(session)
+        self.reply(message, f"↕ Moved {track.title} to position {positions[1] + 1}")
+
+    async def shuffle_command(self, _, message):
+        session = self.sessions.find(message.chat.id)
+        if not session or len(session.queue) < 2:
+            self.reply(message, "❌ Not enough tracks in queue to shuffle!")
+            return
+        session.queue.shuffle()
+        self.prefetcher.schedule(session)
+        self.reply(message, f"🔀 Shuffled {len(session.queue)} tracks")
+
+    async def clear_command(self, _, message):
+        session = self.sessions.find(message.chat.id)
+        if not session or not session.queue:
+            self.reply(message, "🎶 Queue is empty!")
+            return
+        args = message.command[1:]
+        if not args:
+            start, stop = 0, len(session.queue)
+        elif len(args) == 2 and all(arg.isdigit() for arg in args) and 1 <= int(args[0]) <= int(args[1]):
+            start, stop = int(args[0]) - 1, int(args[1])
+        else:
+            self.reply(message, "❓ Usage: /clear [from] [to]")
+            return
+        removed = session.queue.clear_range(start, stop)
+        for track in removed:
+            self.prefetcher.release(track)
+        self.prefetcher.schedule(session)
+        self.reply(message, f"🧹 Removed {len(removed)} tracks from queue")
 
     async def stop_vc(self, _, message):
-        self.chat_id = message.chat.id
+        session = self.sessions.get(message.chat.id)
         try:
-            await self.pytgcalls.leave_call(self.chat_id)
-            self.queue.clear()
-            self.current_track = None
-            await message.reply("🛑 Stopped and left voice chat!")
+            await self.pytgcalls.leave_call(session.chat_id)
+            transition = self.transition_tasks.pop(session.chat_id, None)
+            if transition:
+                transition.cancel()
+            async with session.lock:
+                for track in ([session.current_track] if session.current_track else []) + list(session.queue):
+                    self.prefetcher.release(track)
+                session.queue.clear()
+                session.current_track = None
+                self.sessions.drop(session.chat_id)
+            self.reply(message, "🛑 Stopped and left voice chat!")
         except Exception as e:
-            await message.reply(f"❌ Error stopping voice chat: {str(e)}")
+            self.reply(message, f"❌ Error stopping voice chat: {str(e)}")
 
     async def edit_or_reply(self, msg: Message, **kwargs):
+        from inspect import getfullargspec
+
         func = msg.edit_text if msg.from_user.is_self else msg.reply
         spec = getfullargspec(func.__wrapped__).args
         await func(**{k: v for k, v in kwargs.items() if k in spec})
@@ -236,6 +776,8 @@ class MusicBot:
     async def eval_command(self, client: Client, message: Message):
         if len(message.command) < 2:
             return await self.edit_or_reply(message, text="🔍 Please provide code to evaluate, master!")
+        import traceback
+
         code = message.text.split(" ", maxsplit=1)[1]
         t1 = time()
         stdout = sys.stdout
@@ -278,66 +820,200 @@ class MusicBot:
     async def shellrunner(self, client: Client, message: Message):
         if len(message.command) < 2:
             return await self.edit_or_reply(message, text="<b>Example:</b>\n/sh git pull")
+        import traceback
+        from io import BytesIO
+
         text = message.text.split(None, 1)[1]
-        output = ""
-        if "\n" in text:
-            lines = text.split("\n")
-        else:
-            lines = [text]
-        for cmd in lines:
-            shell = re.split(r""" (?=(?:[^'"]|'[^']*'|"[^"]*")*$)""", cmd)
-            try:
-                process = subprocess.Popen(shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                out, err = process.communicate()
-                if out:
-                    output += out.decode("utf-8")
-                if err:
-                    output += err.decode("utf-8")
-            except Exception as e:
-                error_trace = traceback.format_exc()
-                return await self.edit_or_reply(message, text=f"<b>❌ Error:</b>\n<pre>{error_trace}</pre>")
-        if not output.strip():
-            output = "No Output"
-        if len(output) > 4096:
-            with open("output.txt", "w+", encoding="utf-8") as f:
-                f.write(output)
+        output = StringIO()
+        cancel_markup = InlineKeyboardMarkup(
+            [[InlineKeyboardButton(text="🛑 Cancel", callback_data=f"sh cancel {message.id}")]]
+        )
+        status = await message.reply("<b>⏳ Running...</b>", quote=True, reply_markup=cancel_markup)
+        job = {"process": None, "cancelled": False}
+        self.shell_jobs[message.id] = job
+        try:
+            for cmd in text.split("\n"):
+                shell = re.split(r""" (?=(?:[^'"]|'[^']*'|"[^"]*")*$)""", cmd)
+                try:
+                    await asyncio.wait_for(self.run_shell(shell, output, status, job, cancel_markup), SHELL_TIMEOUT)
+                except asyncio.TimeoutError:
+                    output.write(f"\n⏰ Timed out after {SHELL_TIMEOUT}s\n")
+                    break
+                except Exception:
+                    output.write(f"\n❌ Error:\n{traceback.format_exc()}")
+                    break
+                if job["cancelled"]:
+                    output.write("\n🛑 Cancelled\n")
+                    break
+        finally:
+            self.shell_jobs.pop(message.id, None)
+        result = output.getvalue()
+        if not result.strip():
+            result = "No Output"
+        if len(result) > 4000:
+            document = BytesIO(result.encode("utf-8"))
+            document.name = "output.txt"
             await client.send_document(
                 message.chat.id,
-                "output.txt",
+                document,
                 caption="<code>Output is too long, sent as file</code>",
                 reply_to_message_id=message.id
             )
-            os.remove("output.txt")
+            await status.delete()
         else:
-            await self.edit_or_reply(message, text=f"<b>📤 Output:</b>\n<pre>{output}</pre>")
+            await status.edit_text(f"<b>📤 Output:</b>\n<pre>{html.escape(result)}</pre>")
+
+    @staticmethod
+    async def run_shell(shell: List[str], output: StringIO, status: Message, job: dict, cancel_markup):
+        """Run one command, editing status with its latest output as it arrives."""
+        process = await asyncio.create_subprocess_exec(
+            *shell, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+        )
+        job["process"] = process
+        # A character may be split across two reads.
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        last_edit = time()
+        try:
+            while True:
+                chunk = await process.stdout.read(4096)
+                if not chunk:
+                    output.write(decoder.decode(b"", final=True))
+                    break
+                output.write(decoder.decode(chunk))
+                if time() - last_edit >= SHELL_EDIT_INTERVAL:
+                    last_edit = time()
+                    tail = output.getvalue()[-3500:]
+                    try:
+                        await status.edit_text(f"<b>⏳ Running...</b>\n<pre>{html.escape(tail)}</pre>", reply_markup=cancel_markup)
+                    except Exception:
+                        pass
+            await process.wait()
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+    async def shell_cancel_callback(self, _, query: CallbackQuery):
+        job = self.shell_jobs.get(int(query.data.split()[2]))
+        if not job:
+            await query.answer("Command already finished")
+            return
+        job["cancelled"] = True
+        if job["process"] and job["process"].returncode is None:
+            job["process"].kill()
+        await query.answer("🛑 Cancelling...")
 
     def register_handlers(self):
         self.bot.on_message(filters.command("start"))(self.start_command)
         self.bot.on_message(filters.command("ping"))(self.ping_command)
         self.bot.on_message(filters.command("join"))(self.join_vc)
         self.bot.on_message(filters.command("play"))(self.play_song)
+        self.bot.on_message(filters.command("search"))(self.search_command)
+        self.bot.on_callback_query(filters.regex(r"^lib [A-Za-z0-9_-]+$"))(self.library_callback)
+        self.bot.on_message(filters.command("playlist"))(self.playlist_command)
+        self.bot.on_message(filters.command("album"))(self.album_command)
         self.bot.on_message(filters.command("skip"))(self.skip_song)
         self.bot.on_message(filters.command("pause"))(self.pause_song)
         self.bot.on_message(filters.command("resume"))(self.resume_song)
         self.bot.on_message(filters.command("queue"))(self.queue_command)
+        self.bot.on_callback_query(filters.regex(r"^queue \d+$"))(self.queue_page_callback)
+        self.bot.on_message(filters.command("remove"))(self.remove_command)
+        self.bot.on_message(filters.command("move"))(self.move_command)
+        self.bot.on_message(filters.command("shuffle"))(self.shuffle_command)
+        self.bot.on_message(filters.command("clear"))(self.clear_command)
         self.bot.on_message(filters.command("stop"))(self.stop_vc)
         self.bot.on_message(filters.command("e") & filters.user(self.OWNER_ID))(self.eval_command)
+        self.bot.on_message(filters.command("stats") & filters.user(self.OWNER_ID))(self.stats_command)
         self.bot.on_message(filters.command("sh") & filters.user(self.OWNER_ID))(self.shellrunner)
+        self.bot.on_callback_query(filters.regex(r"^sh cancel \d+$") & filters.user(self.OWNER_ID))(self.shell_cancel_callback)
+        self.pytgcalls.on_update(call_filters.stream_end())(self.on_stream_end)
 
     def run(self):
-        self.ensure_downloads_dir()
         try:
-            self.userbot.start()
-            self.bot.start()
-            self.pytgcalls.start()
-            print(">>> MUSIC BOT STARTED")
+            asyncio.get_event_loop().run_until_complete(self.start())
             idle()
         except Exception as e:
             print(f"Error during bot execution: {str(e)}")
         finally:
             self.cleanup()
 
+    async def start(self):
+        """Start the bot, the assistants and the metrics endpoint together.
+
+        The saved queues are loaded first, so commands find them. The
+        track cache is read meanwhile and those chats rejoin their calls
+        once it is, both in the background: the bot takes commands as soon
+        as its clients are up, which is what startup_seconds measures.
+        """
+        restored = self.sessions.restore()
+        self.cache_warm = asyncio.create_task(self.warm_cache())
+        await asyncio.gather(self.bot.start(), self.pytgcalls.start(), self.start_metrics())
+        self.startup_seconds = time() - STARTED_AT
+        print(f">>> MUSIC BOT STARTED in {self.startup_seconds:.2f}s")
+        task = asyncio.create_task(self.resume_sessions(restored))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def warm_cache(self):
+        """Read the track cache index and index the library, off the event loop."""
+        try:
+            with self.metrics.timer("cache_warm_seconds"):
+                self.cache.load(await asyncio.to_thread(self.cache.read))
+                library = LibraryIndex()
+                await asyncio.to_thread(library.build, list(self.cache.entries.values()))
+                library.follow(self.cache)
+                library.hits, library.searches = self.library.hits, self.library.searches
+                self.library = library
+            print(f">>> TRACK CACHE READY: {len(self.cache.entries)} tracks")
+        except Exception as e:
+            print(f"Error reading track cache: {str(e)}")
+
+    async def resume_sessions(self, restored: List[ChatSession]):
+        """Rejoin the calls of the chats that still had music queued when the bot stopped."""
+        if self.cache_warm:
+            # Their tracks are likely cached, do not download them again.
+            await self.cache_warm
+        # Stopped meanwhile, or already playing again: join_and_play leaves those be.
+        restored = [session for session in restored if self.sessions.find(session.chat_id) is session]
+        for session in restored:
+            self.prefetcher.schedule(session)
+        results = await asyncio.gather(*(self.join_and_play(session) for session in restored), return_exceptions=True)
+        for session, result in zip(restored, results):
+            if isinstance(result, Exception):
+                print(f"Error resuming chat {session.chat_id}: {str(result)}")
+        if restored:
+            print(f">>> RESTORED {len(restored)} CHAT SESSIONS")
+
+    async def start_metrics(self):
+        task = asyncio.create_task(self.metrics.watch_loop_lag())
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        if not METRICS_PORT:
+            return
+        try:
+            self.metrics_runner = await serve_metrics(self.metrics, METRICS_HOST, METRICS_PORT)
+            print(f">>> METRICS ON http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+        except Exception as e:
+            print(f"Error starting metrics endpoint: {str(e)}")
+
     def cleanup(self):
+        try:
+            self.cache.flush()
+        except Exception as e:
+            print(f"Error saving track cache index: {str(e)}")
+        try:
+            self.store.close()
+        except Exception as e:
+            print(f"Error closing session store: {str(e)}")
+        if self.metrics_runner:
+            try:
+                asyncio.get_event_loop().run_until_complete(self.metrics_runner.cleanup())
+            except Exception as e:
+                print(f"Error stopping metrics endpoint: {str(e)}")
+        try:
+            asyncio.get_event_loop().run_until_complete(self.saavn.close())
+        except Exception as e:
+            print(f"Error closing HTTP session: {str(e)}")
         try:
             pyidle()
         except Exception as e:
@@ -347,11 +1023,12 @@ class MusicBot:
         except Exception as e:
             print(f"Error stopping bot: {str(e)}")
         try:
-            self.userbot.stop()
+            asyncio.get_event_loop().run_until_complete(self.pytgcalls.stop())
         except Exception as e:
-            print(f"Error stopping userbot: {str(e)}")
+            print(f"Error stopping assistants: {str(e)}")
         print(">>> MUSIC BOT STOPPED")
 
-bot = MusicBot()
-bot.register_handlers()
-bot.run()
+if __name__ == "__main__":
+    bot = MusicBot()
+    bot.register_handlers()
+    bot.run()